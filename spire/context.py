@@ -1,4 +1,4 @@
-from spire.wsgi.util import Middleware
+from spire.wsgi.util import Middleware, get_environ_index, set_environ_item
 
 class ContextMiddleware(Middleware):
     def __init__(self, parsers, key='request.context'):
@@ -12,7 +12,8 @@ class ContextMiddleware(Middleware):
     def _parse_context(self, environ):
         context = environ.get(self.key)
         if context is None:
-            context = environ[self.key] = {}
+            context = {}
+            set_environ_item(environ, self.key, context)
 
         for parser in self.parsers:
             parser(environ, context)
@@ -20,15 +21,9 @@ class ContextMiddleware(Middleware):
 class HeaderParser(object):
     def __init__(self, prefix='HTTP_X_SPIRE_'):
         self.prefix = prefix
-        self.prefix_length = len(prefix)
 
     def __call__(self, environ, context):
-        prefix = self.prefix
-        length = self.prefix_length
-
-        for name, value in environ.iteritems():
-            if name[:length] == prefix:
-                context[name[length:].lower().replace('_', '-')] = value
+        context.update(get_environ_index(environ).get_headers(environ, self.prefix))
 
 class SessionParser(object):
     def __init__(self, key='request.context', environ_key='request.session'):
@@ -36,8 +31,9 @@ class SessionParser(object):
         self.key = key
 
     def __call__(self, environ, context):
+        # a new session has nothing stored yet, so a lazy one is left unloaded
         session = environ.get(self.environ_key)
-        if session:
+        if session is not None and not session.new:
             value = session.get(self.key)
             if value:
                 context['session-id'] = session.sid
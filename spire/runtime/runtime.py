@@ -12,6 +12,7 @@ from spire.runtime.registration import ServiceEndpoint
 from spire.support.logs import LogHelper, configure_logging
 from spire.util import (enumerate_tagged_methods, find_tagged_method,
     recursive_merge, topological_sort)
+from spire.wsgi.stats import StatsMount
 
 COMPONENTS_SCHEMA = Sequence(Object(name='component', nonnull=True),
     name='components', unique=True)
@@ -28,6 +29,7 @@ PARAMETERS_SCHEMA = Structure({
     'startup_attempts': Integer(default=12),
     'startup_enabled': Boolean(default=True),
     'startup_timeout': Integer(default=5),
+    'stats_path': Text(),
 }, name='parameters')
 
 log = LogHelper('spire.runtime')
@@ -176,6 +178,11 @@ class Runtime(object):
         else:
             log('error', 'execution of %s for startup of %s timed out' % params)
 
+    def _mount_statistics(self, dispatcher):
+        path = self.parameters.get('stats_path')
+        if path:
+            dispatcher.mount(StatsMount(dispatcher, path=path))
+
     def _register_services(self, dispatcher):
         url = self.parameters.get('registration_url')
         if not url:
@@ -6,6 +6,7 @@ import sys
 from spire.local import purge_context_locals
 from spire.runtime.runtime import Runtime, current_runtime
 from spire.util import dump_threads
+from spire.wsgi.application import Application
 from spire.wsgi.util import Mount, MountDispatcher
 
 IPYTHON_CONSOLE_TRIGGER = '/tmp/activate-%s-console'
@@ -60,6 +61,12 @@ class Runtime(Runtime):
         self.dispatcher = MountDispatcher()
         for unit in self.assembly.collate(Mount):
             self.dispatcher.mount(unit)
+        self._mount_statistics(self.dispatcher)
+
+        # applications are mounts rather than components, so their templates
+        # are compiled here, before any worker processes are forked
+        for application in self.assembly.collate(Application):
+            application.compile_templates()
 
         self._register_services(self.dispatcher)
 
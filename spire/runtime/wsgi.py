@@ -1,31 +1,189 @@
+import errno
+import fcntl
 import os
+import signal
+import subprocess
 import sys
+from select import error as SelectError, select
+from threading import Lock, Thread
 
 from werkzeug.wsgi import SharedDataMiddleware
 
+from spire.local import purge_context_locals
 from spire.runtime.runtime import Runtime
-from spire.wsgi.server import WsgiServer
+from spire.support.logs import LogHelper
+from spire.wsgi.application import Application
+from spire.wsgi.server import PreforkSupervisor, WsgiServer
 from spire.wsgi.util import Mount, MountDispatcher
 
+LISTEN_SOCKET_VAR = 'SPIRE_LISTEN_SOCKET'
+READY_PIPE_VAR = 'SPIRE_READY_PIPE'
+RELOAD_SIGNAL = signal.SIGHUP
+
+log = LogHelper('spire.runtime')
+
 class Runtime(Runtime):
-    def __init__(self, address, configuration=None, assembly=None):
+    def __init__(self, address, configuration=None, assembly=None, workers=None,
+            socket_mode=None):
         super(Runtime, self).__init__(configuration, assembly)
+        self.postforks = []
+        self.reloading = Lock()
+        self.supervisor = None
         self.deploy()
         self.startup()
 
         self.dispatcher = MountDispatcher()
         for unit in self.assembly.collate(Mount):
             self.dispatcher.mount(unit)
+        self._mount_statistics(self.dispatcher)
+
+        # applications are mounts rather than components, so their templates
+        # are compiled here, before any worker processes are forked
+        for application in self.assembly.collate(Application):
+            application.compile_templates()
 
-        wsgi = self.configuration.get('wsgi')
-        if wsgi and 'static-map' in wsgi:
+        wsgi = self.configuration.get('wsgi') or {}
+        if 'static-map' in wsgi:
             map = wsgi['static-map'].split('=')
             self.dispatcher = SharedDataMiddleware(self.dispatcher, {
                 map[0]: os.path.abspath(map[1])
             }, cache=False)
 
-        self.server = WsgiServer(address, self.dispatcher)
-        self.server.serve()
+        if socket_mode is None:
+            socket_mode = wsgi.get('socket-mode')
+        if isinstance(socket_mode, basestring):
+            socket_mode = int(socket_mode, 8)
+
+        scaling = {}
+        if 'thread-idle-timeout' in wsgi:
+            scaling['idle_timeout'] = int(wsgi['thread-idle-timeout'])
+
+        self.server = WsgiServer(address, self.dispatcher,
+            numthreads=int(wsgi.get('threads') or 10),
+            maxthreads=int(wsgi.get('max-threads') or 0), scaling=scaling,
+            nodelay=wsgi.get('tcp-nodelay', True), cork=wsgi.get('tcp-cork', False),
+            max_queue_depth=int(wsgi.get('max-queue-depth') or 0),
+            max_queue_wait=float(wsgi.get('max-queue-wait') or 0),
+            shutdown_timeout=float(wsgi.get('drain-timeout') or 5),
+            socket_mode=socket_mode)
+        self.handoff_timeout = float(wsgi.get('handoff-timeout') or 60)
+
+        inherited = os.environ.pop(LISTEN_SOCKET_VAR, None)
+        if inherited:
+            self.server.inherit(*[int(value) for value in inherited.split(':')])
+
+        signal.signal(RELOAD_SIGNAL, self._signal_reload)
+
+        workers = int(workers or wsgi.get('workers') or 1)
+        if workers > 1:
+            self.supervisor = PreforkSupervisor(self.server, workers,
+                wsgi.get('reuse-port', False), self.run_postforks)
+            self.supervisor.run(self._signal_ready)
+        else:
+            self._signal_ready()
+            self.server.serve()
+
+    def reload(self):
+        """Hand the listening socket off to a freshly exec'd runtime, then
+        drain the requests in flight here and exit.
+
+        This runtime does not register services, so a reload is only ever
+        triggered by ``RELOAD_SIGNAL``."""
+        if not self.reloading.acquire(False):
+            return
+
+        if self.supervisor:
+            # Called from the signal handler in the supervisor's main thread,
+            # which has nothing else to do while the handoff occurs.
+            if self._handoff():
+                self.supervisor.stopping = True
+            else:
+                self.reloading.release()
+        else:
+            thread = Thread(target=self._reload, name='spire-reload')
+            thread.start()
+
+    def _handoff(self):
+        sock = self.server.socket
+        environment = dict(os.environ)
+        if sock is not None:
+            fd = sock.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+            environment[LISTEN_SOCKET_VAR] = '%d:%d' % (fd, sock.family)
+
+        reader, writer = os.pipe()
+        environment[READY_PIPE_VAR] = str(writer)
+
+        try:
+            process = subprocess.Popen([sys.executable] + sys.argv,
+                env=environment, close_fds=False)
+        except OSError:
+            log('exception', 'failed to exec a new runtime for reload')
+            os.close(reader)
+            return False
+        finally:
+            os.close(writer)
+            if sock is not None:
+                fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+        try:
+            while True:
+                try:
+                    readable = select([reader], [], [], self.handoff_timeout)[0]
+                except SelectError, error:
+                    if error.args[0] == errno.EINTR:
+                        continue
+                    raise
+                break
+            ready = bool(readable and os.read(reader, 1))
+        finally:
+            os.close(reader)
+
+        if not ready:
+            log('error', 'new runtime (pid %d) did not become ready; continuing to serve'
+                % process.pid)
+            if process.poll() is None:
+                process.terminate()
+            return False
+
+        log('info', 'handed off to new runtime (pid %d); draining' % process.pid)
+        return True
+
+    def _reload(self):
+        if self._handoff():
+            self.server.drain()
+        else:
+            self.reloading.release()
+
+    def _signal_ready(self):
+        writer = os.environ.pop(READY_PIPE_VAR, None)
+        if writer:
+            writer = int(writer)
+            try:
+                os.write(writer, 'r')
+            finally:
+                os.close(writer)
+
+    def _signal_reload(self, signum, frame):
+        self.reload()
+
+    def register_postfork(self, function):
+        self.postforks.append(function)
+
+    def run_postforks(self):
+        # The supervisor owns the listening socket and performs the reload;
+        # workers ignore the signal when it is sent to the process group.
+        signal.signal(RELOAD_SIGNAL, signal.SIG_IGN)
+        purge_context_locals()
+
+        schema = sys.modules.get('spire.schema.schema')
+        if schema:
+            for interface in self.assembly.collate(schema.SchemaInterface):
+                interface.purge()
+
+        for function in self.postforks:
+            function()
 
 if __name__ == '__main__':
     Runtime(*sys.argv[1:])
@@ -0,0 +1,71 @@
+from threading import Lock
+
+PREVIOUS, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    """A thread-safe mapping which holds at most ``capacity`` entries, evicting
+    the least recently used entry to make room for a new one."""
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.entries = {}
+        self.guard = Lock()
+
+        self.root = root = []
+        root[:] = [root, root, None, None]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.guard:
+            self.entries.clear()
+            root = self.root
+            root[:] = [root, root, None, None]
+
+    def get(self, key, default=None):
+        with self.guard:
+            link = self.entries.get(key)
+            if link is None:
+                return default
+
+            self._unlink(link)
+            self._append(link)
+            return link[VALUE]
+
+    def pop(self, key, default=None):
+        with self.guard:
+            link = self.entries.pop(key, None)
+            if link is None:
+                return default
+
+            self._unlink(link)
+            return link[VALUE]
+
+    def put(self, key, value):
+        with self.guard:
+            link = self.entries.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[VALUE] = value
+            else:
+                if len(self.entries) >= self.capacity:
+                    oldest = self.root[NEXT]
+                    self._unlink(oldest)
+                    del self.entries[oldest[KEY]]
+                link = self.entries[key] = [None, None, key, value]
+            self._append(link)
+
+    def _append(self, link):
+        root = self.root
+        last = root[PREVIOUS]
+        link[PREVIOUS], link[NEXT] = last, root
+        last[NEXT] = root[PREVIOUS] = link
+
+    def _unlink(self, link):
+        previous, next = link[PREVIOUS], link[NEXT]
+        previous[NEXT] = next
+        next[PREVIOUS] = previous
@@ -0,0 +1,70 @@
+from bisect import bisect_left
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0)
+
+class Histogram(object):
+    """A thread-safe histogram of durations, in seconds, over fixed buckets."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.guard = Lock()
+        self.maximum = 0.0
+        self.sum = 0.0
+        self.total = 0
+
+    def cumulate(self):
+        """Returns a list of ``(upper bound, cumulative count)`` pairs, ending
+        with a ``None`` bound for the overflow bucket."""
+
+        with self.guard:
+            counts = list(self.counts)
+
+        cumulative, total = [], 0
+        for bound, count in zip(self.buckets + (None,), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def percentile(self, percentile):
+        """Estimates the given percentile by interpolating within buckets."""
+
+        with self.guard:
+            counts = list(self.counts)
+            maximum = self.maximum
+            total = self.total
+
+        if not total:
+            return 0.0
+
+        target = total * percentile / 100.0
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= target:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else maximum
+                upper = min(upper, maximum)
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return maximum
+
+    def record(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.guard:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum += value
+            if value > self.maximum:
+                self.maximum = value
+
+    def summarize(self):
+        return {
+            'count': self.total,
+            'sum': self.sum,
+            'max': self.maximum,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
@@ -31,6 +31,32 @@ class DumpConfiguration(SpireTask):
         self.driver.deploy()
         runtime.report(pformat(self.assembly.configuration), True)
 
+class PrecompileTemplates(SpireTask):
+    name = 'spire.templates.precompile'
+    description = 'precompiles the templates of each wsgi application'
+
+    def run(self, runtime):
+        from spire.wsgi.application import Application
+        self.prepare(runtime)
+
+        for application in self.assembly.collate(Application):
+            if application.environment:
+                count = application.environment.precompile()
+                runtime.report('precompiled %d templates for %r' % (count, application))
+
+class RebuildSessionIndex(SpireTask):
+    name = 'spire.sessions.rebuild-index'
+    description = 'rebuilds the user index of each session backend'
+
+    def run(self, runtime):
+        from spire.wsgi.sessions import SessionBackend
+        self.prepare(runtime)
+
+        for backend in self.assembly.collate(SessionBackend):
+            count = backend.rebuild_index()
+            if count is not None:
+                runtime.report('indexed %d sessions for %r' % (count, backend))
+
 class StartDaemon(Task):
     name = 'spire.daemon'
     description = 'starts a spire server using the daemon driver'
@@ -70,10 +96,13 @@ class StartWsgiServer(Task):
     name = 'spire.wsgi'
     description = 'starts a spire server using the wsgi driver'
     parameters = {
-        'address': Text(description='hostname:port', default='localhost:8000'),
+        'address': Text(description='hostname:port or unix:/path/to.sock', default='localhost:8000'),
         'config': Path(description='path to spire configuration file', default=path('spire.yaml')),
+        'socket_mode': Text(description='octal permissions for a unix socket'),
+        'workers': Integer(description='number of worker processes', minimum=1),
     }
 
     def run(self, runtime):
         from spire.runtime.wsgi import Runtime
-        Runtime(self['address'], self['config'])
+        Runtime(self['address'], self['config'], workers=self['workers'],
+            socket_mode=self['socket_mode'])
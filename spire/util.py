@@ -2,7 +2,7 @@ import hashlib
 import os
 import re
 import sys
-from inspect import getargspec, stack
+from inspect import getargs, getargspec, isclass, isfunction, ismethod, stack
 from traceback import extract_stack
 from types import ModuleType
 from urllib import urlencode
@@ -10,8 +10,23 @@ from urllib2 import urlopen
 from urlparse import urlparse, urlunparse
 from uuid import uuid4, uuid5
 
+class InvocationPlan(object):
+    """A plan for calling ``callable`` with only the keyword params it names,
+    prepared once instead of on every call."""
+
+    def __init__(self, callable):
+        self.callable = callable
+        self.arguments = get_supported_params(callable)
+
+    def __call__(self, *args, **params):
+        arguments = self.arguments
+        for key in params.keys():
+            if key not in arguments:
+                del params[key]
+        return self.callable(*args, **params)
+
 def call_with_supported_params(callable, *args, **params):
-    arguments = getargspec(callable)[0]
+    arguments = get_supported_params(callable)
     for key in params.keys():
         if key not in arguments:
             del params[key]
@@ -93,6 +108,39 @@ def get_constructor_args(cls, ignore_private=True, _cache={}):
     _cache[cls] = arguments
     return arguments
 
+def get_supported_params(callable, _cache={}):
+    """Returns the names of the params ``callable`` accepts by keyword; params
+    only accepted through ``**kwargs`` are not included.
+
+    Functions, bound and unbound methods, classes and instances implementing
+    ``__call__`` are supported; the inspection is cached per code object."""
+
+    bound = True
+    if isfunction(callable):
+        function, bound = callable, False
+    elif ismethod(callable):
+        function, bound = callable.im_func, callable.im_self is not None
+    elif isclass(callable):
+        function = getattr(callable.__init__, 'im_func', callable.__init__)
+    else:
+        function = getattr(callable.__call__, 'im_func', callable.__call__)
+
+    code = getattr(function, 'func_code', None)
+    if code is None:
+        raise TypeError('%r is not a python callable' % callable)
+
+    try:
+        return _cache[code, bound]
+    except KeyError:
+        pass
+
+    arguments = getargs(code)[0]
+    if bound:
+        arguments = arguments[1:]
+
+    supported = _cache[code, bound] = frozenset(arguments)
+    return supported
+
 def get_package_data(module, path=None):
     openfile = open(get_package_path(module, path))
     try:
@@ -1,4 +1,6 @@
-from scheme import Sequence, Text, Tuple
+from time import time
+
+from scheme import Boolean, Sequence, Text, Tuple
 from scheme.supplemental import ObjectReference
 from werkzeug.exceptions import HTTPException, InternalServerError, NotFound
 from werkzeug.local import Local, release_local
@@ -7,16 +9,24 @@ from werkzeug.wrappers import Request as WsgiRequest, Response
 
 from spire.core import *
 from spire.local import ContextLocals
-from spire.util import call_with_supported_params, enumerate_modules, is_class, is_module, is_package
+from spire.support.cache import LRUCache
+from spire.support.logs import LogHelper
+from spire.util import InvocationPlan, enumerate_modules, is_class, is_module, is_package
+from spire.wsgi.routing import RouteCache
 from spire.wsgi.templates import TemplateEnvironment
-from spire.wsgi.util import Mount
+from spire.wsgi.util import Mount, get_environ_index
 
 ContextLocal = ContextLocals.declare('wsgi.request')
 
+log = LogHelper('spire.wsgi')
+
 class Request(WsgiRequest):
     """A WSGI request."""
 
     def __init__(self, application, environ, urls):
+        # Consulted before the werkzeug request adds itself to the environ.
+        attributes = get_environ_index(environ).get_attributes(environ)
+
         super(Request, self).__init__(environ)
         self.application = application
         self.endpoint = None
@@ -24,9 +34,8 @@ class Request(WsgiRequest):
         self.template_context = {}
         self.urls = urls
 
-        for name, value in environ.iteritems():
-            if name[:8] == 'request.':
-                setattr(self, name[8:], value)
+        for name, value in attributes.iteritems():
+            setattr(self, name, value)
 
     @property
     def forwarded_ip(self):
@@ -44,7 +53,7 @@ class Request(WsgiRequest):
             return
 
         try:
-            self.endpoint, self.params = self.urls.match()
+            self.endpoint, self.params = self.application.routes.match(self.urls)
         except (HTTPException, RequestRedirect), error:
             return error
         else:
@@ -74,12 +83,16 @@ class Application(Mount):
 
     configuration = Configuration({
         'mediators': Sequence(Text(nonempty=True), unique=True),
+        'precompile_templates': Boolean(default=False),
+        'template_cache': Text(description='directory for compiled templates'),
+        'template_reload': Boolean(default=True),
         'templates': Sequence(Tuple((Text(nonempty=True), Text(nonempty=True)))),
         'urls': ObjectReference(nonnull=True, required=True),
         'views': Sequence(ObjectReference(nonnull=True), unique=True),
     })
 
-    def __init__(self, urls, views=None, templates=None, mediators=None):
+    def __init__(self, urls, views=None, templates=None, mediators=None,
+            template_cache=None, template_reload=True):
         super(Application, self).__init__()
         if isinstance(urls, (list, tuple)):
             urls = Map(list(urls))
@@ -87,11 +100,18 @@ class Application(Mount):
             raise Exception()
 
         self.urls = urls
+        self.routes = RouteCache(urls)
         self.views = self._collect_views(views)
+        self.plans = dict((endpoint, InvocationPlan(view))
+            for endpoint, view in self.views.iteritems())
 
         self.environment = None
         if templates:
-            self.environment = TemplateEnvironment(templates)
+            cache_size = 50
+            if self.configuration.get('precompile_templates') or not template_reload:
+                cache_size = -1
+            self.environment = TemplateEnvironment(templates, cache_dir=template_cache,
+                auto_reload=template_reload, cache_size=cache_size)
 
         self.mediators = []
         if mediators:
@@ -108,6 +128,11 @@ class Application(Mount):
         except HTTPException, error:
             return error(environ, start_response)
 
+    def compile_templates(self):
+        if self.environment and self.configuration.get('precompile_templates'):
+            count = self.environment.precompile()
+            log('info', 'precompiled %d templates for %r', count, self)
+
     def _dispatch_request(self, environ):
         urls = self.urls.bind_to_environ(environ)
         request = Request(self, environ, urls)
@@ -124,19 +149,19 @@ class Application(Mount):
                 else:
                     response = None
 
-            view = None
+            plan = None
             if not response:
                 response = request.match()
                 if not response:
-                    view = self.views.get(request.endpoint)
-                    if not view:
-                        view = self.views.get('default')
-                    if not view:
+                    plan = self.plans.get(request.endpoint)
+                    if not plan:
+                        plan = self.plans.get('default')
+                    if not plan:
                         response = NotFound()
 
             if not response:
                 try:
-                    response = call_with_supported_params(view, request, **request.params)
+                    response = plan(request, **request.params)
                     if not isinstance(response, Response):
                         response = Response(response)
                 except HTTPException:
@@ -196,6 +221,103 @@ class Mediator(object):
     def mediate_response(self, request, response):
         return response
 
+class CacheMediator(Mediator):
+    """A mediator which caches the responses of views decorated with
+    ``@cached``.
+
+    Successful responses to GET requests are kept for ``ttl`` seconds, in a
+    cache holding at most ``capacity`` responses, keyed by url and the values
+    of the request headers named by ``vary``. Cached responses carry an ETag,
+    so a request whose If-None-Match matches it receives a 304 response. Cache
+    hits are served without calling the view.
+
+    Since a cache hit also skips every mediator listed after this one, it
+    must be listed after any mediator which authenticates or authorizes
+    requests. Requests carrying credentials, in a Cookie or Authorization
+    header, are only cached when that header is named by ``vary``; responses
+    marked private or no-store are never cached, and Set-Cookie headers are
+    never stored."""
+
+    credentials = ('authorization', 'cookie')
+
+    def __init__(self, capacity=1024, ttl=60, vary=None):
+        self.cache = LRUCache(capacity)
+        self.ttl = ttl
+        self.vary = tuple(vary or ())
+
+    def mediate_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+
+        if request.match():
+            return None
+
+        views = request.application.views
+        view = views.get(request.endpoint) or views.get('default')
+
+        policy = getattr(view, '__cached__', None)
+        if policy is None:
+            return None
+
+        vary = self.vary + policy['vary']
+        varied = set(name.lower() for name in vary)
+        for name in self.credentials:
+            if name not in varied and name in request.headers:
+                return None
+
+        key = (request.url, vary, tuple(request.headers.get(name) for name in vary))
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            expires, status, headers, data = entry
+            if expires > time():
+                response = Response(data, status=status, headers=headers)
+                return self._make_conditional(request, response)
+            self.cache.pop(key)
+
+        if request.method == 'GET':
+            request.cache_entry = (key, vary, policy['ttl'])
+        return None
+
+    def mediate_response(self, request, response):
+        entry = getattr(request, 'cache_entry', None)
+        if entry is None or response.status_code != 200 or response.is_streamed:
+            return response
+
+        cache_control = response.cache_control
+        if cache_control.private or cache_control.no_store:
+            return response
+
+        key, vary, ttl = entry
+        if ttl is None:
+            ttl = self.ttl
+
+        response.vary.update(vary)
+        response.add_etag()
+
+        headers = [(name, value) for name, value in response.headers
+            if name.lower() != 'set-cookie']
+        self.cache.put(key, (time() + ttl, response.status, headers, response.data))
+        return self._make_conditional(request, response)
+
+    def _make_conditional(self, request, response):
+        # If-None-Match is compared weakly, so that a tag weakened by a
+        # CompressionMiddleware still matches
+        etag = response.get_etag()[0]
+        if etag and request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            return response
+        return response.make_conditional(request.environ)
+
+def cached(ttl=None, vary=None):
+    """Marks a view as cacheable by a ``CacheMediator``, optionally with its
+    own ``ttl`` and additional ``vary`` headers."""
+
+    def decorator(obj):
+        obj.__cached__ = {'ttl': ttl, 'vary': tuple(vary or ())}
+        return obj
+    return decorator
+
 def view(endpoint):
     if hasattr(endpoint, '__call__'):
         endpoint.__viewable__ = True
@@ -1,9 +1,116 @@
 import os
+from tempfile import SpooledTemporaryFile
+from urllib import unquote_plus
 
+from scheme import Integer
 from werkzeug.exceptions import MethodNotAllowed
+from werkzeug.wsgi import FileWrapper
+
+from spire.core import Configuration
 from spire.wsgi.util import Mount
 
+CHUNK_SIZE = 65536
+
+class FormFieldReader(object):
+    """Reads the fields of an urlencoded form from ``stream`` one at a time.
+
+    Iterating yields a ``(name, values)`` pair for each field, where
+    ``values`` yields the decoded value in chunks; a value which is not
+    consumed is skipped when the next field is read."""
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.buffer = ''
+        self.chunk_size = chunk_size
+        self.stream = stream
+
+    def __iter__(self):
+        while True:
+            name = self._read_name()
+            if name is None:
+                return
+
+            values = self._read_value()
+            yield name, values
+            for chunk in values:
+                pass
+
+    def drain(self):
+        self.buffer = ''
+        while self.stream.read(self.chunk_size):
+            pass
+
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if chunk:
+            self.buffer += chunk
+            return True
+        else:
+            return False
+
+    def _read_name(self):
+        while True:
+            buffer = self.buffer
+            for index, character in enumerate(buffer):
+                if character in '=&':
+                    break
+            else:
+                if self._fill():
+                    continue
+                elif not buffer:
+                    return None
+                index = len(buffer)
+
+            name = buffer[:index]
+            if buffer[index:index + 1] == '=':
+                index += 1
+            self.buffer = buffer[index:]
+
+            if name:
+                return unquote_plus(name).decode('utf8', 'replace')
+            for chunk in self._read_value():
+                pass
+
+    def _read_value(self):
+        while True:
+            buffer = self.buffer
+            index = buffer.find('&')
+            if index >= 0:
+                self.buffer = buffer[index + 1:]
+                if index:
+                    yield unquote_plus(buffer[:index])
+                return
+
+            # an escape sequence split across reads is held back until complete
+            index = buffer.find('%', max(len(buffer) - 2, 0))
+            if index >= 0:
+                buffer, self.buffer = buffer[:index], buffer[index:]
+            else:
+                self.buffer = ''
+
+            if buffer:
+                yield unquote_plus(buffer)
+            if not self._fill():
+                if self.buffer:
+                    yield unquote_plus(self.buffer)
+                    self.buffer = ''
+                return
+
 class ClientDownloadEndPoint(Mount):
+    """Echoes the ``data`` field of a submitted form back as a download.
+
+    Urlencoded forms are read incrementally, and ``data`` is buffered, in
+    memory up to ``spool_size`` bytes and in a temporary file beyond that, so
+    that the response only starts once the whole request has been read; most
+    clients send their entire request before reading the response. Only when
+    the request is no larger than ``stream_size`` bytes, and so fits within
+    the socket buffers, and ``mimetype`` and ``filename`` precede ``data`` in
+    the form, is ``data`` streamed from the request straight into the
+    response."""
+
+    configuration = Configuration({
+        'spool_size': Integer(minimum=0, default=1048576),
+        'stream_size': Integer(minimum=0, default=65536),
+    })
 
     def _dispatch_request(self, request, response):
         if request.method == 'GET':
@@ -13,11 +120,44 @@ class ClientDownloadEndPoint(Mount):
 
         # default is csv
         # but you can specify any mimetype and filename you want from within the form being submitted
-        mimetype = request.form.get('mimetype', 'text/csv')
-        filename = request.form.get('filename', 'data.csv')
-        data = request.form.get('data', '')
+        if request.mimetype == 'application/x-www-form-urlencoded':
+            fields, content = self._read_form(request)
+        else:
+            fields = request.form
+            content = [fields.get('data', '').encode('utf8')]
+
+        mimetype = fields.get('mimetype', 'text/csv')
+        filename = fields.get('filename', 'data.csv')
         response.headers = {
             'content-type': mimetype + '; charset=utf-8',
             'content-disposition': 'attachment;filename='+filename
         }
-        response.data = data
+        response.response = content
+
+    def _read_form(self, request):
+        reader = FormFieldReader(request.stream)
+        fields = {}
+
+        length = request.content_length
+        streamable = (length is not None and length <= self.configuration['stream_size'])
+
+        for name, values in reader:
+            if name in fields:
+                continue
+            elif name != 'data':
+                fields[name] = ''.join(values).decode('utf8', 'replace')
+            elif streamable and 'mimetype' in fields and 'filename' in fields:
+                return fields, self._stream_data(reader, values)
+            else:
+                spool = SpooledTemporaryFile(self.configuration['spool_size'])
+                for chunk in values:
+                    spool.write(chunk)
+                spool.seek(0)
+                fields['data'] = FileWrapper(spool, CHUNK_SIZE)
+
+        return fields, fields.pop('data', [])
+
+    def _stream_data(self, reader, values):
+        for chunk in values:
+            yield chunk
+        reader.drain()
@@ -0,0 +1,185 @@
+import zlib
+
+from scheme import Boolean, Integer, Sequence, Text
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+from spire.core import Configuration, Unit, configured_property
+from spire.wsgi.util import Middleware
+
+ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+COMPRESSIBLE_MIMETYPES = ['application/javascript', 'application/json',
+    'application/x-javascript', 'application/xml', 'image/svg+xml', 'text/css',
+    'text/csv', 'text/html', 'text/javascript', 'text/plain', 'text/xml']
+
+class CompressionMiddleware(Unit, Middleware):
+    """A middleware which compresses responses with gzip or deflate.
+
+    Responses are compressed as they are produced, chunk by chunk, with each
+    chunk flushed as it is compressed, and their entity tags are weakened. A
+    response is only compressed if the client accepts either encoding, its
+    mimetype is allowed, it isn't encoded already and it isn't smaller than
+    the minimum size; when a response has no Content-Length, its leading
+    chunks are held back until either the minimum size is reached or the
+    response ends."""
+
+    configuration = Configuration({
+        'enabled': Boolean(default=True, required=True),
+        'level': Integer(minimum=1, maximum=9, default=6),
+        'mimetypes': Sequence(Text(nonempty=True), unique=True,
+            default=COMPRESSIBLE_MIMETYPES),
+        'minimum_size': Integer(minimum=0, default=1024),
+    })
+
+    enabled = configured_property('enabled')
+    level = configured_property('level')
+    minimum_size = configured_property('minimum_size')
+
+    def __init__(self):
+        self.mimetypes = frozenset(self.configuration['mimetypes'])
+
+    def dispatch(self, application, environ, start_response):
+        encoding = None
+        if self.enabled and environ.get('REQUEST_METHOD') != 'HEAD':
+            encoding = self._negotiate_encoding(environ)
+        if encoding is None:
+            return application(environ, start_response)
+
+        response = CompressedResponse(self, encoding, start_response)
+        content = application(environ, response.start_response)
+        return ClosingIterator(response.compress(content), getattr(content, 'close', None))
+
+    def is_compressible(self, status, headers):
+        """Returns whether a response with the given status and headers should
+        be compressed, or None if that depends upon its (unknown) length."""
+
+        code = int(status[:3])
+        if code < 200 or code in (204, 206, 304):
+            return False
+
+        mimetype = length = None
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-encoding':
+                return False
+            elif name == 'content-type':
+                mimetype = value.split(';', 1)[0].strip().lower()
+            elif name == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    return False
+            elif name == 'cache-control' and 'no-transform' in value.lower():
+                return False
+
+        if mimetype not in self.mimetypes:
+            return False
+        if length is not None:
+            return length >= self.minimum_size
+        return None
+
+    def _negotiate_encoding(self, environ):
+        header = environ.get('HTTP_ACCEPT_ENCODING')
+        if not header:
+            return None
+
+        accepted = parse_accept_header(header)
+        encoding, quality = None, 0
+        for candidate in ('gzip', 'deflate'):
+            candidate_quality = accepted.quality(candidate)
+            if candidate_quality > quality:
+                encoding, quality = candidate, candidate_quality
+        return encoding
+
+class CompressedResponse(object):
+    """The state of a single response passing through a CompressionMiddleware."""
+
+    def __init__(self, middleware, encoding, start_response):
+        self.compressor = None
+        self.encoding = encoding
+        self.exc_info = None
+        self.headers = None
+        self.middleware = middleware
+        self.started = False
+        self.status = None
+        self.write_through = None
+        self.wrapped_start_response = start_response
+
+    def compress(self, content):
+        minimum_size = self.middleware.minimum_size
+        pending, size = [], 0
+
+        for chunk in content:
+            if not self.started:
+                compressible = self.middleware.is_compressible(self.status, self.headers)
+                if compressible is None:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if size < minimum_size:
+                        continue
+                    compressible, chunk, pending = True, ''.join(pending), []
+                self._start(compressible)
+
+            if self.compressor:
+                chunk = self._compress(chunk)
+            yield chunk
+
+        if not self.started and self.status is not None:
+            compressible = self.middleware.is_compressible(self.status, self.headers)
+            self._start(bool(compressible) and size >= minimum_size)
+
+            chunk = ''.join(pending)
+            if self.compressor:
+                chunk = self._compress(chunk)
+            if chunk:
+                yield chunk
+
+        if self.compressor:
+            yield self.compressor.flush()
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info and self.started:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        self.status = status
+        self.headers = headers
+        self.exc_info = exc_info
+        return self.write
+
+    def write(self, data):
+        if not self.started:
+            self._start(False)
+        self.write_through(data)
+
+    def _compress(self, chunk):
+        # each chunk is flushed, so that a streamed response is written as
+        # it is produced rather than whenever zlib's buffer fills
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _start(self, compressible):
+        headers = self.headers
+        if compressible:
+            headers = []
+            for name, value in self.headers:
+                name_lower = name.lower()
+                if name_lower in ('content-length', 'vary'):
+                    continue
+                elif name_lower == 'etag' and not value.startswith('W/'):
+                    # the compressed body differs from the one the entity
+                    # tag was computed for, so it is only weakly equivalent
+                    value = 'W/' + value
+                headers.append((name, value))
+            headers.append(('Content-Encoding', self.encoding))
+
+            vary = [value for name, value in self.headers if name.lower() == 'vary']
+            if not any('accept-encoding' in value.lower() for value in vary):
+                vary.append('Accept-Encoding')
+            headers.append(('Vary', ', '.join(vary)))
+
+            self.compressor = zlib.compressobj(self.middleware.level, zlib.DEFLATED,
+                ENCODINGS[self.encoding])
+
+        self.started = True
+        self.write_through = self.wrapped_start_response(self.status, headers,
+            self.exc_info)
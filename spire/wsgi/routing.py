@@ -0,0 +1,68 @@
+from threading import Lock
+
+from spire.support.cache import LRUCache
+
+class RouteCache(object):
+    """Memoizes the matching of requests against a werkzeug url map.
+
+    Rules without any arguments are compiled into a dispatch table keyed by
+    path. The outcome of matching a rule which has defaults but no converters
+    depends only on the host, method and path of the request, so it is kept
+    in a bounded cache. Everything else, including redirects and errors, is
+    left to the map. Both are rebuilt whenever rules are added to the map.
+    """
+
+    def __init__(self, urls, capacity=1024):
+        self.cache = LRUCache(capacity)
+        self.guard = Lock()
+        self.size = None
+        self.table = {}
+        self.urls = urls
+
+    def match(self, adapter):
+        """Matches the request bound to ``adapter``, returning an endpoint and
+        a dictionary of params just as ``adapter.match()`` does."""
+
+        urls = self.urls
+        if len(urls._rules) != self.size:
+            self._compile()
+
+        path = adapter.path_info
+        if not path:
+            return adapter.match()
+
+        path = u'/' + path.lstrip(u'/')
+        method = adapter.default_method
+
+        if not urls.host_matching and adapter.subdomain == urls.default_subdomain:
+            rules = self.table.get(path)
+            if rules:
+                for rule in rules:
+                    if rule.methods is None or method in rule.methods:
+                        return rule.endpoint, {}
+
+        key = (adapter.server_name, adapter.subdomain, method, path)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0], dict(cached[1])
+
+        rule, params = adapter.match(return_rule=True)
+        if not rule.arguments.difference(rule.defaults or ()):
+            self.cache.put(key, (rule.endpoint, dict(params)))
+        return rule.endpoint, params
+
+    def _compile(self):
+        with self.guard:
+            urls = self.urls
+            urls.update()
+
+            table = {}
+            for rule in urls._rules:
+                if (rule.arguments or rule.build_only or rule.redirect_to is not None
+                        or rule.subdomain != urls.default_subdomain):
+                    continue
+                table.setdefault(rule.rule, []).append(rule)
+
+            self.table = table
+            self.cache.clear()
+            self.size = len(urls._rules)
@@ -72,11 +72,14 @@ __all__ = ['HTTPRequest', 'HTTPConnection', 'HTTPServer',
            'SizeCheckWrapper', 'KnownLengthRFile', 'ChunkedRFile',
            'CP_fileobject',
            'MaxSizeExceeded', 'NoSSLError', 'FatalSSLAlert',
-           'WorkerThread', 'ThreadPool', 'SSLAdapter',
+           'WorkerThread', 'ThreadPool', 'ThreadPoolScaler', 'ConnectionManager',
+           'SSLAdapter',
            'CherryPyWSGIServer',
            'Gateway', 'WSGIGateway', 'WSGIGateway_10', 'WSGIGateway_u0',
+           'FileWrapper',
            'WSGIPathInfoDispatcher', 'get_ssl_adapter_class']
 
+import atexit
 import os
 try:
     import queue
@@ -84,7 +87,10 @@ except:
     import Queue as queue
 import re
 import rfc822
+import select
+import signal
 import socket
+import stat
 import sys
 if 'win' in sys.platform and not hasattr(socket, 'IPPROTO_IPV6'):
     socket.IPPROTO_IPV6 = 41
@@ -142,6 +148,7 @@ NUMBER_SIGN = ntob('#')
 QUESTION_MARK = ntob('?')
 ASTERISK = ntob('*')
 FORWARD_SLASH = ntob('/')
+HEAD_TERMINATOR = ntob('\r\n\r\n')
 quoted_slash = re.compile(ntob("(?i)%2F"))
 
 import errno
@@ -177,6 +184,13 @@ socket_errors_to_ignore.append("The read operation timed out")
 socket_errors_nonblocking = plat_specific_errors(
     'EAGAIN', 'EWOULDBLOCK', 'WSAEWOULDBLOCK')
 
+TCP_CORK = getattr(socket, 'TCP_CORK', None)
+
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', None)
+if SO_REUSEPORT is None and sys.platform.startswith('linux'):
+    # Python 2 does not export the constant; Linux has had it since 3.9.
+    SO_REUSEPORT = 15
+
 comma_separated_headers = [ntob(h) for h in
     ['Accept', 'Accept-Charset', 'Accept-Encoding',
      'Accept-Language', 'Accept-Ranges', 'Allow', 'Cache-Control',
@@ -202,9 +216,7 @@ def read_headers(rfile, hdict=None):
     This function raises ValueError when the read bytes violate the HTTP spec.
     You should probably return "400 Bad Request" if this happens.
     """
-    if hdict is None:
-        hdict = {}
-
+    lines = []
     while True:
         line = rfile.readline()
         if not line:
@@ -216,7 +228,22 @@ def read_headers(rfile, hdict=None):
             break
         if not line.endswith(CRLF):
             raise ValueError("HTTP requires CRLF terminators")
+        lines.append(line[:-2])
+
+    return parse_headers(lines, hdict)
 
+
+def parse_headers(lines, hdict=None):
+    """Parse the given header lines (without terminators) into a header dict.
+
+    If hdict is None, a new header dict is created. Returns the populated
+    header dict. This function raises ValueError when a line violates the
+    HTTP spec.
+    """
+    if hdict is None:
+        hdict = {}
+
+    for line in lines:
         if line[0] in (SPACE, TAB):
             # It's a continuation line.
             v = line.strip()
@@ -316,8 +343,14 @@ class KnownLengthRFile(object):
 
     def __init__(self, rfile, content_length):
         self.rfile = rfile
+        self.length = content_length
         self.remaining = content_length
 
+    def _get_touched(self):
+        return self.remaining != self.length
+    touched = property(_get_touched, doc="""
+        Whether any of the body has been read.""")
+
     def read(self, size=None):
         if self.remaining == 0:
             return ''
@@ -558,6 +591,10 @@ class HTTPRequest(object):
 
         self.ready = False
         self.started_request = False
+        # Only the first request served after a wait on the Queue waited;
+        # later requests on a keep-alive connection report no queue wait.
+        self.queue_wait = conn.queue_wait
+        conn.queue_wait = None
         self.scheme = ntob("http")
         if self.server.ssl_adapter is not None:
             self.scheme = ntob("https")
@@ -574,6 +611,11 @@ class HTTPRequest(object):
 
     def parse_request(self):
         """Parse the next HTTP request start-line and message-headers."""
+        if hasattr(self.conn.rfile, 'read_head'):
+            if self.read_request_head():
+                self.ready = True
+            return
+
         self.rfile = SizeCheckWrapper(self.conn.rfile,
                                       self.server.max_request_header_size)
         try:
@@ -629,6 +671,10 @@ class HTTPRequest(object):
             self.simple_response("400 Bad Request", "HTTP requires CRLF terminators")
             return False
 
+        return self.parse_request_line(request_line)
+
+    def parse_request_line(self, request_line):
+        """Parse the given Request-Line. Return success."""
         try:
             method, uri, req_protocol = request_line.strip().split(SPACE, 2)
             rp = int(req_protocol[5]), int(req_protocol[7])
@@ -707,6 +753,74 @@ class HTTPRequest(object):
             self.simple_response("400 Bad Request", ex.args[0])
             return False
 
+        return self.process_request_headers()
+
+    def read_request_head(self):
+        """Read and parse the Request-Line and headers in a single pass.
+
+        Rather than reading line by line, this reads from the socket in bulk
+        until the blank line which ends the request head, then splits it.
+        Return success.
+        """
+        rfile = self.conn.rfile
+        try:
+            head = rfile.read_head(self.server.max_request_header_size)
+        except MaxSizeExceeded:
+            self.started_request = True
+            ex = sys.exc_info()[1]
+            if ex.args and ex.args[0]:
+                self.simple_response("413 Request Entity Too Large",
+                    "The headers sent with the request exceed the maximum "
+                    "allowed bytes.")
+            else:
+                self.simple_response("414 Request-URI Too Long",
+                    "The Request-URI sent with the request exceeds the maximum "
+                    "allowed bytes.")
+            return False
+        except socket.error:
+            # Only a client which has begun a request deserves a 408.
+            self.started_request = rfile.has_buffered_data()
+            raise
+
+        # Set started_request to True so communicate() knows to send 408
+        # from here on out.
+        self.started_request = True
+        if not head:
+            return False
+
+        if head[:2] == CRLF:
+            # RFC 2616 sec 4.1: ignore one leading CRLF; see read_request_line.
+            head = head[2:]
+
+        if not head.endswith(HEAD_TERMINATOR):
+            if head.endswith(LF + LF) or LF not in head:
+                self.simple_response("400 Bad Request",
+                                     "HTTP requires CRLF terminators")
+            else:
+                self.simple_response("400 Bad Request", "Illegal end of headers.")
+            return False
+
+        lines = head[:-4].split(CRLF)
+        for line in lines:
+            if LF in line:
+                self.simple_response("400 Bad Request",
+                                     "HTTP requires CRLF terminators")
+                return False
+
+        if not self.parse_request_line(lines[0]):
+            return False
+
+        try:
+            parse_headers(lines[1:], self.inheaders)
+        except ValueError:
+            ex = sys.exc_info()[1]
+            self.simple_response("400 Bad Request", ex.args[0])
+            return False
+
+        return self.process_request_headers()
+
+    def process_request_headers(self):
+        """Act upon the parsed self.inheaders. Return success."""
         mrbs = self.server.max_request_body_size
         if mrbs and int(self.inheaders.get("Content-Length", 0)) > mrbs:
             self.simple_response("413 Request Entity Too Large",
@@ -828,13 +942,41 @@ class HTTPRequest(object):
                 return
             self.rfile = KnownLengthRFile(self.conn.rfile, cl)
 
-        self.server.gateway(self).respond()
+        corked = self.server.cork and self.conn.cork(True)
+        try:
+            self.server.gateway(self).respond()
+
+            if (self.ready and not self.sent_headers):
+                self.sent_headers = True
+                self.send_headers(last=True)
+            elif self.chunked_write:
+                self.conn.wfile.sendall("0\r\n\r\n")
+        finally:
+            if corked:
+                self.conn.cork(False)
 
-        if (self.ready and not self.sent_headers):
-            self.sent_headers = True
-            self.send_headers()
-        if self.chunked_write:
-            self.conn.wfile.sendall("0\r\n\r\n")
+        # An application which began reading wsgi.input may still be doing
+        # so while its response is written, so what it leaves is only read
+        # once the response is complete.
+        self.drain_body()
+
+    def drain_body(self):
+        """Read and discard any remaining request body data on the socket."""
+        if (not self.close_connection) and (not self.chunked_read):
+            # "If an origin server receives a request that does not include an
+            # Expect request-header field with the "100-continue" expectation,
+            # the request includes a request body, and the server responds
+            # with a final status code before reading the entire request body
+            # from the transport connection, then the server SHOULD NOT close
+            # the transport connection until it has read the entire request,
+            # or until the client closes the connection. Otherwise, the client
+            # might not reliably receive the response message. However, this
+            # requirement is not be construed as preventing a server from
+            # defending itself against denial-of-service attacks, or from
+            # badly broken client implementations."
+            while getattr(self.rfile, 'remaining', 0) > 0:
+                if not self.rfile.read(65536):
+                    break
 
     def simple_response(self, status, msg=""):
         """Write a simple response back to the client."""
@@ -878,14 +1020,22 @@ class HTTPRequest(object):
         else:
             self.conn.wfile.sendall(chunk)
 
-    def send_headers(self):
+    def send_headers(self, chunk=EMPTY, last=False):
         """Assert, process, and send the HTTP response message-headers.
 
         You must set self.status, and self.outheaders before calling this.
+
+        If given, the first chunk of the response body is sent in the same
+        write as the headers when it is no larger than the server's
+        coalesce_size; if last is True, so is the end of a chunked body.
         """
         hkeys = [key.lower() for key, value in self.outheaders]
         status = int(self.status[:3])
 
+        if not self.server.ready:
+            # The server is draining; don't keep the connection alive.
+            self.close_connection = True
+
         if status == 413:
             # Request Entity Too Large. Close conn to avoid garbage.
             self.close_connection = True
@@ -915,22 +1065,11 @@ class HTTPRequest(object):
                 if not self.close_connection:
                     self.outheaders.append(("Connection", "Keep-Alive"))
 
-        if (not self.close_connection) and (not self.chunked_read):
-            # Read any remaining request body data on the socket.
-            # "If an origin server receives a request that does not include an
-            # Expect request-header field with the "100-continue" expectation,
-            # the request includes a request body, and the server responds
-            # with a final status code before reading the entire request body
-            # from the transport connection, then the server SHOULD NOT close
-            # the transport connection until it has read the entire request,
-            # or until the client closes the connection. Otherwise, the client
-            # might not reliably receive the response message. However, this
-            # requirement is not be construed as preventing a server from
-            # defending itself against denial-of-service attacks, or from
-            # badly broken client implementations."
-            remaining = getattr(self.rfile, 'remaining', 0)
-            if remaining > 0:
-                self.rfile.read(remaining)
+        if not getattr(self.rfile, 'touched', True):
+            # The application never read the body. A client which sends its
+            # whole body before reading the response would otherwise block
+            # while the response is being written, so read it now.
+            self.drain_body()
 
         if "date" not in hkeys:
             self.outheaders.append(("Date", rfc822.formatdate()))
@@ -942,6 +1081,20 @@ class HTTPRequest(object):
         for k, v in self.outheaders:
             buf.append(k + COLON + SPACE + v + CRLF)
         buf.append(CRLF)
+
+        if chunk and len(chunk) > self.server.coalesce_size:
+            # Copying a large chunk would cost more than the extra write.
+            self.conn.wfile.sendall(EMPTY.join(buf))
+            self.write(chunk)
+            return
+
+        if chunk:
+            if self.chunked_write:
+                buf.extend([hex(len(chunk))[2:], CRLF, chunk, CRLF])
+            else:
+                buf.append(chunk)
+        if last and self.chunked_write:
+            buf.append("0\r\n\r\n")
         self.conn.wfile.sendall(EMPTY.join(buf))
 
 
@@ -978,6 +1131,70 @@ class CP_fileobject(socket._fileobject):
         self.bytes_written += bytes_sent
         return bytes_sent
 
+    def read_head(self, maxlen=0):
+        """Read up to and including the blank line which ends an HTTP head.
+
+        Data is received in blocks and any bytes following the head are
+        left in the buffer. If the peer closes the connection first, the
+        partial head (or an empty string) is returned. MaxSizeExceeded is
+        raised, with a single argument saying whether the first line was
+        complete, if maxlen is set and the head exceeds it.
+        """
+        if _fileobject_uses_str_type:
+            data = self._rbuf
+        else:
+            data = self._rbuf.getvalue()
+        self._set_rbuf(EMPTY)
+
+        recv_size = max(self._rbufsize, self.default_bufsize)
+        start = 0
+        try:
+            while True:
+                end = data.find(HEAD_TERMINATOR, max(start - 3, 0))
+                if end >= 0:
+                    end += 4
+                    break
+                # Find bare LF terminators too, so that they receive a 400
+                # rather than waiting for a CRLF which may never come.
+                end = data.find(LF + LF, max(start - 1, 0))
+                if end >= 0:
+                    end += 2
+                    break
+                if maxlen and len(data) > maxlen:
+                    raise MaxSizeExceeded(data.find(LF, 0, maxlen) >= 0)
+
+                start = len(data)
+                chunk = self.recv(recv_size)
+                if not chunk:
+                    end = len(data)
+                    break
+                data += chunk
+        except:
+            self._set_rbuf(data)
+            raise
+
+        if maxlen and end > maxlen:
+            self._set_rbuf(data)
+            raise MaxSizeExceeded(data.find(LF, 0, maxlen) >= 0)
+
+        self._set_rbuf(data[end:])
+        return data[:end]
+
+    def _set_rbuf(self, data):
+        if _fileobject_uses_str_type:
+            self._rbuf = data
+        else:
+            self._rbuf = StringIO.StringIO()
+            self._rbuf.write(data)
+
+    def has_buffered_data(self):
+        """Return True if bytes already received from the socket are buffered."""
+        if _fileobject_uses_str_type:
+            return bool(self._rbuf)
+        else:
+            self._rbuf.seek(0, 2)
+            return self._rbuf.tell() > 0
+
     def flush(self):
         if self._wbuf:
             buffer = "".join(self._wbuf)
@@ -1278,7 +1495,12 @@ class HTTPConnection(object):
         self.requests_seen = 0
 
     def communicate(self):
-        """Read each request and respond appropriately."""
+        """Read each request and respond appropriately.
+
+        Returns True if the connection is idle and should be kept alive by
+        the server's ConnectionManager (rather than by the calling worker
+        thread) until the client sends its next request.
+        """
         request_seen = False
         try:
             while True:
@@ -1302,6 +1524,11 @@ class HTTPConnection(object):
                 req.respond()
                 if req.close_connection:
                     return
+
+                # If the client has not pipelined another request, hand the
+                # idle connection back so this worker can serve another one.
+                if self.parkable and not self.rfile.has_buffered_data():
+                    return True
         except socket.error:
             e = sys.exc_info()[1]
             errnum = e.args[0]
@@ -1355,6 +1582,58 @@ class HTTPConnection(object):
 
     linger = False
 
+    queued_at = None
+    """The time at which this connection was last put on the request Queue."""
+
+    queue_wait = None
+    """The seconds this connection last waited on the Queue for a worker, until
+    the first request read after that wait claims it."""
+
+    def reject(self):
+        """Answer 503 Service Unavailable without reading a request.
+
+        This is a best-effort response; socket errors are ignored, since the
+        connection is about to be closed anyway.
+        """
+        msg = "The server is too busy to handle this request."
+        buf = ["%s 503 Service Unavailable\r\n" % self.server.protocol,
+               "Content-Length: %s\r\n" % len(msg),
+               "Content-Type: text/plain\r\n",
+               "Retry-After: %s\r\n" % self.server.retry_after,
+               "Connection: close\r\n\r\n",
+               msg]
+        try:
+            self.wfile.sendall("".join(buf))
+            # Discard what the client has sent so far; closing a socket with
+            # unread data makes the kernel send RST, which may destroy the
+            # response before the client reads it.
+            self.socket.setblocking(0)
+            self.socket.recv(65536)
+        except socket.error:
+            pass
+
+    def cork(self, enabled):
+        """Set or clear TCP_CORK on this connection; return True on success.
+
+        Clearing the option flushes any partial segment immediately.
+        """
+        if TCP_CORK is None or isinstance(self.server.bind_addr, basestring):
+            return False
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, TCP_CORK, int(enabled))
+        except (AttributeError, socket.error):
+            return False
+        return True
+
+    def _get_parkable(self):
+        return (self.server.connections is not None
+                and self.server.ssl_adapter is None
+                and isinstance(self.rfile, CP_fileobject))
+    parkable = property(_get_parkable, doc="""
+        Whether this connection may be parked between requests. SSL
+        connections are never parked, since the SSL layer may be holding
+        decrypted data which the socket will never report as readable.""")
+
     def close(self):
         """Close the socket underlying this connection."""
         self.rfile.close()
@@ -1438,20 +1717,45 @@ class WorkerThread(threading.Thread):
                 if conn is _SHUTDOWNREQUEST:
                     return
 
+                if conn.queued_at:
+                    conn.queue_wait = time.time() - conn.queued_at
+
+                mqw = self.server.max_queue_wait
+                if mqw and conn.queue_wait is not None and conn.queue_wait > mqw:
+                    # The client has likely given up; don't start work on it.
+                    self.server.count('Expired Connections')
+                    try:
+                        conn.reject()
+                    finally:
+                        conn.close()
+                    continue
+
                 self.conn = conn
                 if self.server.stats['Enabled']:
                     self.start_time = time.time()
+                keepalive = False
                 try:
-                    conn.communicate()
+                    keepalive = conn.communicate()
                 finally:
-                    conn.close()
                     if self.server.stats['Enabled']:
                         self.requests_seen += self.conn.requests_seen
                         self.bytes_read += self.conn.rfile.bytes_read
                         self.bytes_written += self.conn.wfile.bytes_written
                         self.work_time += time.time() - self.start_time
                         self.start_time = None
+                        # A parked connection comes back to a worker later,
+                        # so reset its counters to avoid counting them twice.
+                        conn.requests_seen = 0
+                        conn.rfile.bytes_read = 0
+                        conn.wfile.bytes_written = 0
                     self.conn = None
+                    # The server may have stopped (and dropped its manager)
+                    # while this connection was being served.
+                    connections = self.server.connections
+                    if keepalive and connections is not None:
+                        connections.put(conn)
+                    else:
+                        conn.close()
         except (KeyboardInterrupt, SystemExit):
             exc = sys.exc_info()[1]
             self.server.interrupt = exc
@@ -1484,11 +1788,21 @@ class ThreadPool(object):
                 time.sleep(.1)
 
     def _get_idle(self):
-        """Number of worker threads which are idle. Read-only."""
-        return len([t for t in self._threads if t.conn is None])
+        """Number of live worker threads which are idle. Read-only."""
+        return len([t for t in self._threads if t.conn is None and t.isAlive()])
     idle = property(_get_idle, doc=_get_idle.__doc__)
 
+    def cull(self):
+        """Remove worker threads which have exited, such as those which took
+        a shutdown request from shrink(). Returns the number removed."""
+        dead = [t for t in self._threads if not t.isAlive()]
+        for t in dead:
+            self._threads.remove(t)
+        return len(dead)
+
     def put(self, obj):
+        if obj is not _SHUTDOWNREQUEST:
+            obj.queued_at = time.time()
         self._queue.put(obj)
         if obj is _SHUTDOWNREQUEST:
             return
@@ -1507,7 +1821,7 @@ class ThreadPool(object):
         """Kill off worker threads (not below self.min)."""
         # Grow/shrink the pool if necessary.
         # Remove any dead threads from our list
-        for t in self._threads:
+        for t in self._threads[:]:
             if not t.isAlive():
                 self._threads.remove(t)
                 amount -= 1
@@ -1562,6 +1876,259 @@ class ThreadPool(object):
     qsize = property(_get_qsize)
 
 
+class ThreadPoolScaler(object):
+    """Grows and shrinks a server's ThreadPool according to its queue depth.
+
+    The server calls tick() from its listening loop. At most once per
+    interval, the pool is grown by the number of queued connections which
+    no idle worker can take (up to pool.max), and shrunk back toward
+    pool.min once more than 'spare' workers have been idle for
+    'idle_timeout' seconds without interruption.
+    """
+
+    interval = 1
+    """The minimum number of seconds between two samples of the pool."""
+
+    idle_timeout = 30
+    """How long, in seconds, surplus workers must stay idle before they are
+    shut down. This is the hysteresis between growing and shrinking."""
+
+    spare = 0
+    """The number of idle workers (above pool.min) kept for bursts."""
+
+    def __init__(self, server, interval=None, idle_timeout=None, spare=None):
+        self.server = server
+        if interval is not None:
+            self.interval = interval
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if spare is not None:
+            self.spare = spare
+
+        self._next_sample = 0
+        self._idle_since = None
+
+    def tick(self):
+        now = time.time()
+        if now < self._next_sample:
+            return
+        self._next_sample = now + self.interval
+
+        pool = self.server.requests
+        pool.cull()
+        idle = pool.idle
+        backlog = pool.qsize - idle
+        if backlog > 0:
+            self._idle_since = None
+            size = len(pool._threads)
+            if pool.max <= 0 or size < pool.max:
+                pool.grow(backlog)
+                self._record('Threads Grown', len(pool._threads) - size)
+        elif idle > self.spare:
+            if self._idle_since is None:
+                self._idle_since = now
+            elif now - self._idle_since >= self.idle_timeout:
+                self._idle_since = None
+                size = len(pool._threads)
+                excess = min(idle - self.spare, size - pool.min)
+                if excess > 0:
+                    pool.shrink(excess)
+                    self._record('Threads Shrunk', excess)
+        else:
+            self._idle_since = None
+
+    def _record(self, key, amount):
+        self.server.count(key, amount)
+        self.server.stats['Last Scaling'] = time.time()
+
+
+class Poller(object):
+    """A minimal readability poller over file descriptors.
+
+    Uses epoll where available, and poll otherwise.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._events = select.EPOLLIN | select.EPOLLPRI
+            self._scale = 1
+        else:
+            self._poller = select.poll()
+            self._events = select.POLLIN | select.POLLPRI
+            self._scale = 1000
+
+    def register(self, fd):
+        self._poller.register(fd, self._events)
+
+    def unregister(self, fd):
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, IOError, OSError, ValueError):
+            pass
+
+    def poll(self, timeout):
+        """Return the list of readable file descriptors."""
+        try:
+            return [fd for fd, event in self._poller.poll(timeout * self._scale)]
+        except (select.error, IOError, OSError):
+            x = sys.exc_info()[1]
+            if x.args[0] in socket_error_eintr:
+                return []
+            raise
+
+    def close(self):
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+
+
+class ConnectionManager(object):
+    """Holds idle keep-alive connections until their sockets become readable.
+
+    Worker threads put() a connection here after its last response instead
+    of blocking in readline() until the client's next request. The server's
+    listening thread calls poll() from tick(), which moves readable
+    connections back onto the request Queue and closes connections which
+    have been idle for longer than the server timeout.
+    """
+
+    supported = (os.name == 'posix'
+                 and (hasattr(select, 'epoll') or hasattr(select, 'poll')))
+    """Whether connections can be parked on this platform."""
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._pending = []
+        self._next_expiration = 0
+
+        self._poller = Poller()
+        self._listener = None
+        self._wakeup, self._waker = os.pipe()
+        for fd in (self._wakeup, self._waker):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self._poller.register(self._wakeup)
+
+    def _get_idle(self):
+        """Number of parked connections. Read-only."""
+        return len(self._connections) + len(self._pending)
+    idle = property(_get_idle, doc=_get_idle.__doc__)
+
+    def put(self, conn):
+        """Park the given (idle) connection. Safe to call from any thread."""
+        self._lock.acquire()
+        try:
+            if self.closed:
+                conn.close()
+                return
+            self._pending.append(conn)
+        finally:
+            self._lock.release()
+
+        # Wake the listening thread so it starts watching this connection.
+        try:
+            os.write(self._waker, ntob('x'))
+        except OSError:
+            # The pipe is full, so a wakeup is already pending.
+            pass
+
+    def poll(self, listener, timeout=1):
+        """Re-queue readable connections; return True if listener is readable.
+
+        This must only be called by the server's listening thread.
+        """
+        if self.closed:
+            return False
+
+        fd = listener.fileno()
+        if fd != self._listener:
+            if self._listener is not None:
+                self._poller.unregister(self._listener)
+            self._poller.register(fd)
+            self._listener = fd
+
+        self._lock.acquire()
+        try:
+            pending, self._pending = self._pending, []
+        finally:
+            self._lock.release()
+
+        now = time.time()
+        for conn in pending:
+            try:
+                conn_fd = conn.socket.fileno()
+                self._poller.register(conn_fd)
+            except (socket.error, IOError, OSError, ValueError):
+                conn.close()
+            else:
+                self._connections[conn_fd] = (conn, now)
+
+        try:
+            readable = self._poller.poll(timeout)
+        except (select.error, IOError, OSError, ValueError):
+            if self.closed:
+                return False
+            raise
+
+        accept = False
+        for ready in readable:
+            if ready == self._listener:
+                accept = True
+            elif ready == self._wakeup:
+                try:
+                    while os.read(self._wakeup, 4096):
+                        pass
+                except OSError:
+                    pass
+            else:
+                entry = self._connections.pop(ready, None)
+                if entry is not None:
+                    self._poller.unregister(ready)
+                    self.server.requests.put(entry[0])
+
+        now = time.time()
+        if now >= self._next_expiration:
+            self._next_expiration = now + 1
+            self.expire(now - self.server.timeout)
+        return accept
+
+    def expire(self, threshold):
+        """Close parked connections which have been idle since threshold."""
+        for fd, (conn, since) in list(self._connections.items()):
+            if since < threshold:
+                del self._connections[fd]
+                self._poller.unregister(fd)
+                conn.close()
+
+    def close(self):
+        """Close all parked connections and release the poller."""
+        self._lock.acquire()
+        try:
+            self.closed = True
+            pending, self._pending = self._pending, []
+        finally:
+            self._lock.release()
+
+        for conn in pending:
+            conn.close()
+        for fd, (conn, since) in list(self._connections.items()):
+            self._poller.unregister(fd)
+            conn.close()
+        self._connections = {}
+
+        self._poller.close()
+        for fd in (self._wakeup, self._waker):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
 
 try:
     import fcntl
@@ -1667,6 +2234,57 @@ class HTTPServer(object):
     nodelay = True
     """If True (the default since 3.1), sets the TCP_NODELAY socket option."""
 
+    cork = False
+    """If True, sets the TCP_CORK socket option (where available) on TCP
+    connections while each response is written, so that the response leaves
+    in as few segments as possible."""
+
+    max_queue_depth = 0
+    """The maximum number of connections waiting for a worker thread, or 0
+    for no limit. New connections accepted beyond it are answered with
+    503 Service Unavailable straight away, once the thread pool has grown
+    as far as it may."""
+
+    max_queue_wait = 0
+    """The maximum number of seconds a connection may wait for a worker
+    thread, or 0 for no limit. Connections which waited longer are answered
+    with 503 Service Unavailable instead of being served."""
+
+    retry_after = 1
+    """The Retry-After value, in seconds, sent with 503 responses."""
+
+    socket_mode = 511
+    """The permissions given to a UNIX socket once it is bound, or None to
+    leave them to the umask. The default lets everyone access the socket."""
+
+    draining = False
+    """If True, the server is stopping gracefully, and connections accepted
+    after it stopped being ready are still served."""
+
+    coalesce_size = 16384
+    """The largest first body chunk, in bytes, which is sent in the same write
+    as the response headers."""
+
+    keepalive_parking = False
+    """If True, idle keep-alive connections are parked in a ConnectionManager
+    between requests instead of occupying a worker thread."""
+
+    connections = None
+    """The ConnectionManager holding parked connections, or None."""
+
+    scaler = None
+    """A ThreadPoolScaler which resizes the worker pool from tick(), or None."""
+
+    reuse_port = False
+    """If True, sets the SO_REUSEPORT socket option so that several processes
+    may each bind their own socket to the same address."""
+
+    multiprocess = False
+    """The value to set for wsgi.multiprocess in the WSGI environ."""
+
+    socket = None
+    """The listening socket, or None if the server has not been prepared."""
+
     ConnectionClass = HTTPConnection
     """The class to use for handling HTTP connections."""
 
@@ -1685,6 +2303,7 @@ class HTTPServer(object):
         if not server_name:
             server_name = socket.gethostname()
         self.server_name = server_name
+        self.stats_lock = threading.Lock()
         self.clear_stats()
 
     def clear_stats(self):
@@ -1699,7 +2318,13 @@ class HTTPServer(object):
             'Queue': lambda s: getattr(self.requests, "qsize", None),
             'Threads': lambda s: len(getattr(self.requests, "_threads", [])),
             'Threads Idle': lambda s: getattr(self.requests, "idle", None),
+            'Threads Max': lambda s: getattr(self.requests, "max", None),
+            'Threads Grown': 0,
+            'Threads Shrunk': 0,
+            'Last Scaling': None,
             'Socket Errors': 0,
+            'Rejected Connections': 0,
+            'Expired Connections': 0,
             'Requests': lambda s: (not s['Enabled']) and -1 or sum([w['Requests'](w) for w
                                        in s['Worker Threads'].values()], 0),
             'Bytes Read': lambda s: (not s['Enabled']) and -1 or sum([w['Bytes Read'](w) for w
@@ -1718,6 +2343,21 @@ class HTTPServer(object):
             }
         logging.statistics["CherryPy HTTPServer %d" % id(self)] = self.stats
 
+    def count(self, key, amount=1):
+        """Add amount to the given counter in self.stats, from any thread."""
+        self.stats_lock.acquire()
+        try:
+            self.stats[key] += amount
+        finally:
+            self.stats_lock.release()
+
+    def can_grow(self):
+        """Return whether the scaler may still add threads to the pool."""
+        if self.scaler is None:
+            return False
+        pool = self.requests
+        return pool.max <= 0 or len(pool._threads) < pool.max
+
     def runtime(self):
         if self._start_time is None:
             return self._run_time
@@ -1769,6 +2409,43 @@ class HTTPServer(object):
         if self.software is None:
             self.software = "%s Server" % self.version
 
+        if self.socket is None:
+            self.prepare()
+
+        # Create worker threads
+        self.requests.start()
+
+        if self.keepalive_parking and ConnectionManager.supported:
+            self.connections = ConnectionManager(self)
+            # tick() only accepts once the listening socket polls readable,
+            # and another process sharing the socket may win the race.
+            self.socket.settimeout(0)
+
+        self.ready = True
+        self._start_time = time.time()
+        while self.ready:
+            try:
+                self.tick()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.error_log("Error in HTTPServer.tick", level=logging.ERROR,
+                               traceback=True)
+
+            if self.interrupt:
+                while self.interrupt is True:
+                    # Wait for self.stop() to complete. See _set_interrupt.
+                    time.sleep(0.1)
+                if self.interrupt:
+                    raise self.interrupt
+
+    def prepare(self):
+        """Create, bind and listen on the server socket.
+
+        This is called by start() if no socket has been bound yet; calling
+        it beforehand allows the bound socket to be shared with forked
+        processes which each call start().
+        """
         # SSL backward compatibility
         if (self.ssl_adapter is None and
             getattr(self, 'ssl_certificate', None) and
@@ -1793,12 +2470,7 @@ class HTTPServer(object):
             # AF_UNIX socket
 
             # So we can reuse the socket...
-            try: os.unlink(self.bind_addr)
-            except: pass
-
-            # So everyone can access the socket...
-            try: os.chmod(self.bind_addr, 511) # nosec AppScan
-            except: pass
+            self.remove_stale_socket(self.bind_addr)
 
             info = [(socket.AF_UNIX, socket.SOCK_STREAM, 0, "", self.bind_addr)]
         else:
@@ -1831,30 +2503,43 @@ class HTTPServer(object):
         if not self.socket:
             raise socket.error(msg)
 
+        if isinstance(self.bind_addr, basestring) and self.socket_mode is not None:
+            # So the intended users can access the socket...
+            os.chmod(self.bind_addr, self.socket_mode)
+
         # Timeout so KeyboardInterrupt can be caught on Win32
         self.socket.settimeout(1)
         self.socket.listen(self.request_queue_size)
 
-        # Create worker threads
-        self.requests.start()
+    def remove_stale_socket(self, path):
+        """Remove a UNIX socket left behind by a server which has exited.
 
-        self.ready = True
-        self._start_time = time.time()
-        while self.ready:
-            try:
-                self.tick()
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except:
-                self.error_log("Error in HTTPServer.tick", level=logging.ERROR,
-                               traceback=True)
+        Raises socket.error if the path exists but isn't a socket, or if a
+        server is still listening on it.
+        """
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise socket.error(errno.EADDRINUSE,
+                               "%s exists and is not a socket" % path)
 
-            if self.interrupt:
-                while self.interrupt is True:
-                    # Wait for self.stop() to complete. See _set_interrupt.
-                    time.sleep(0.1)
-                if self.interrupt:
-                    raise self.interrupt
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                probe.connect(path)
+            except socket.error:
+                x = sys.exc_info()[1]
+                if x.args[0] == errno.ECONNREFUSED:
+                    os.unlink(path)
+                elif x.args[0] != errno.ENOENT:
+                    raise
+            else:
+                raise socket.error(errno.EADDRINUSE,
+                                   "a server is already listening on %s" % path)
+        finally:
+            probe.close()
 
     def error_log(self, msg="", level=20, traceback=False):
         # Override this in subclasses as desired
@@ -1870,6 +2555,10 @@ class HTTPServer(object):
         self.socket = socket.socket(family, type, proto)
         prevent_socket_inheritance(self.socket)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            if SO_REUSEPORT is None:
+                raise socket.error("SO_REUSEPORT is not supported")
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
         if self.nodelay and not isinstance(self.bind_addr, str):
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
@@ -1891,16 +2580,37 @@ class HTTPServer(object):
 
     def tick(self):
         """Accept a new connection and put it on the Queue."""
+        scaler = self.scaler
+        if scaler is not None:
+            scaler.tick()
+
+        # drain() may release the socket from another thread at any time.
+        sock = self.socket
+        if sock is None:
+            return
+
+        connections = self.connections
+        if connections is not None:
+            # Wait for either a new connection or a parked one to wake up.
+            if not connections.poll(sock):
+                return
+
         try:
-            s, addr = self.socket.accept()
+            s, addr = sock.accept()
             if self.stats['Enabled']:
                 self.stats['Accepts'] += 1
-            if not self.ready:
+            if not self.ready and not self.draining:
                 return
 
             prevent_socket_inheritance(s)
             if hasattr(s, 'settimeout'):
                 s.settimeout(self.timeout)
+            if self.nodelay and not isinstance(self.bind_addr, basestring):
+                # Not every platform copies this from the listening socket.
+                try:
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                except socket.error:
+                    pass
 
             makefile = CP_fileobject
             ssl_env = {}
@@ -1949,6 +2659,16 @@ class HTTPServer(object):
 
             conn.ssl_env = ssl_env
 
+            mqd = self.max_queue_depth
+            if (mqd and getattr(self.requests, 'qsize', 0) >= mqd
+                    and not self.can_grow()):
+                self.count('Rejected Connections')
+                try:
+                    conn.reject()
+                finally:
+                    conn.close()
+                return
+
             self.requests.put(conn)
         except socket.timeout:
             # The only reason for the timeout in start() is so we can
@@ -2027,6 +2747,10 @@ class HTTPServer(object):
                 sock.close()
             self.socket = None
 
+        if self.connections is not None:
+            self.connections.close()
+            self.connections = None
+
         self.requests.stop(self.shutdown_timeout)
 
 
@@ -2076,6 +2800,64 @@ def get_ssl_adapter_class(name='pyopenssl'):
 # -------------------------------- WSGI Stuff -------------------------------- #
 
 
+def _get_sendfile():
+    """Return a sendfile(out_fd, in_fd, offset, count) callable, or None."""
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None:
+        return sendfile
+    if not sys.platform.startswith('linux'):
+        # The BSD and Darwin calls have different signatures.
+        return None
+
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        function = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    function.argtypes = [ctypes.c_int, ctypes.c_int,
+                         ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    function.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        position = ctypes.c_int64(offset)
+        sent = function(out_fd, in_fd, ctypes.byref(position), count)
+        if sent < 0:
+            num = ctypes.get_errno()
+            raise OSError(num, os.strerror(num))
+        return sent
+    return sendfile
+
+sendfile = _get_sendfile()
+
+
+class FileWrapper(object):
+    """The wsgi.file_wrapper supplied to WSGI applications.
+
+    When the wrapped file is a regular file and the connection is a plain
+    socket, WSGIGateway transmits it with sendfile(2); otherwise the wrapper
+    is iterated like any other response, reading blksize bytes at a time.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+    __next__ = next
+
+
+
 class CherryPyWSGIServer(HTTPServer):
     """A subclass of HTTPServer which calls a WSGI application."""
 
@@ -2096,6 +2878,7 @@ class CherryPyWSGIServer(HTTPServer):
 
         self.timeout = timeout
         self.shutdown_timeout = shutdown_timeout
+        self.stats_lock = threading.Lock()
         self.clear_stats()
 
     def _get_numthreads(self):
@@ -2122,6 +2905,9 @@ class WSGIGateway(Gateway):
         """Process the current request."""
         response = self.req.server.wsgi_app(self.env, self.start_response)
         try:
+            if isinstance(response, FileWrapper) and self.sendfile(response):
+                return
+
             for chunk in response:
                 # "The start_response callable must not actually transmit
                 # the response headers. Instead, it must store them for the
@@ -2137,6 +2923,74 @@ class WSGIGateway(Gateway):
             if hasattr(response, "close"):
                 response.close()
 
+    def sendfile(self, wrapper):
+        """Transmit the file in the given FileWrapper with sendfile(2).
+
+        Returns False, having sent nothing, if the file or the connection
+        does not allow it; the caller should then iterate the wrapper.
+        """
+        req = self.req
+        if (sendfile is None or req.server.ssl_adapter is not None
+            or not self.started_response):
+            return False
+
+        filelike = wrapper.filelike
+        try:
+            fd = filelike.fileno()
+            st = os.fstat(fd)
+            offset = filelike.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+        if not stat.S_ISREG(st.st_mode):
+            return False
+
+        count = st.st_size - offset
+        if self.remaining_bytes_out is not None:
+            count = min(count, self.remaining_bytes_out)
+        if count <= 0:
+            return True
+
+        if not req.sent_headers:
+            req.sent_headers = True
+            req.send_headers()
+
+        wfile = req.conn.wfile
+        if req.chunked_write:
+            wfile.sendall(EMPTY.join([hex(count)[2:], CRLF]))
+
+        sock = req.conn.socket
+        timeout = sock.gettimeout()
+        remaining = count
+        while remaining > 0:
+            try:
+                sent = sendfile(sock.fileno(), fd, offset, remaining)
+            except OSError:
+                x = sys.exc_info()[1]
+                if x.errno in socket_error_eintr:
+                    continue
+                if x.errno not in socket_errors_nonblocking:
+                    # Let HTTPConnection.communicate treat this like any
+                    # other failure to write to the client.
+                    raise socket.error(x.errno, x.strerror)
+                # The socket has a timeout, and so is non-blocking.
+                r, w, e = select.select([], [sock], [], timeout)
+                if not w:
+                    raise socket.timeout("timed out")
+                continue
+            if not sent:
+                # The file was truncated while we were sending it.
+                raise IOError("File ended %d bytes short of the expected size."
+                              % remaining)
+            offset += sent
+            remaining -= sent
+            wfile.bytes_written += sent
+
+        if req.chunked_write:
+            wfile.sendall(CRLF)
+        if self.remaining_bytes_out is not None:
+            self.remaining_bytes_out -= count
+        return True
+
     def start_response(self, status, headers, exc_info = None):
         """WSGI callable to begin the HTTP response."""
         # "The application may call start_response more than once,
@@ -2191,9 +3045,9 @@ class WSGIGateway(Gateway):
 
         if not self.req.sent_headers:
             self.req.sent_headers = True
-            self.req.send_headers()
-
-        self.req.write(chunk)
+            self.req.send_headers(chunk)
+        else:
+            self.req.write(chunk)
 
         if rbo is not None:
             rbo -= chunklen
@@ -2225,14 +3079,18 @@ class WSGIGateway_10(WSGIGateway):
             'SERVER_PROTOCOL': req.request_protocol,
             'SERVER_SOFTWARE': req.server.software,
             'wsgi.errors': sys.stderr,
+            'wsgi.file_wrapper': FileWrapper,
             'wsgi.input': req.rfile,
-            'wsgi.multiprocess': False,
+            'wsgi.multiprocess': req.server.multiprocess,
             'wsgi.multithread': True,
             'wsgi.run_once': False,
             'wsgi.url_scheme': req.scheme,
             'wsgi.version': (1, 0),
             }
 
+        if req.queue_wait is not None:
+            env['spire.queue_wait'] = req.queue_wait
+
         if isinstance(req.server.bind_addr, basestring):
             # AF_UNIX. This isn't really allowed by WSGI, which doesn't
             # address unix domain sockets. But it's better than nothing.
@@ -2332,18 +3190,201 @@ class WSGIPathInfoDispatcher(object):
 # ----- spire additions -----
 
 class WsgiServer(CherryPyWSGIServer):
-    def __init__(self, address, application, numthreads=10, timeout=10):
-        if isinstance(address, basestring):
-            hostname, port = address.split(':')
+    def __init__(self, address, application, numthreads=10, timeout=10,
+            keepalive_parking=True, maxthreads=None, scaling=None, nodelay=True,
+            cork=False, max_queue_depth=0, max_queue_wait=0, shutdown_timeout=5,
+            socket_mode=None):
+        if isinstance(address, basestring) and address.startswith('unix:'):
+            address = address[5:]
         else:
-            hostname, port = address
+            if isinstance(address, basestring):
+                hostname, port = address.split(':')
+            else:
+                hostname, port = address
+            address = (hostname, int(port))
 
-        address = (hostname, int(port))
         super(WsgiServer, self).__init__(address, application, numthreads=numthreads,
-            timeout=timeout)
+            max=maxthreads or -1, timeout=timeout, shutdown_timeout=shutdown_timeout)
+        self.keepalive_parking = keepalive_parking
+        self.nodelay = nodelay
+        self.cork = cork
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        if socket_mode is not None:
+            self.socket_mode = socket_mode
+
+        if maxthreads and maxthreads > numthreads:
+            self.scaler = ThreadPoolScaler(self, **(scaling or {}))
+
+    def drain(self):
+        """Stop accepting connections and finish the requests in flight.
+
+        This may be called from any thread, including a signal handler;
+        serve() returns once the requests in flight have finished. Unlike
+        stop(), the listening socket isn't touched to wake the accepting
+        thread, since another process may be sharing the socket.
+        """
+        self.draining = True
+        self.ready = False
+
+    def inherit(self, fd, family):
+        """Adopt an already bound and listening socket, such as one handed
+        off by a reloading process, instead of binding a new one."""
+        sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+        os.close(fd)
+        prevent_socket_inheritance(sock)
+        sock.settimeout(1)
+        self.socket = sock
 
     def serve(self):
         try:
             self.start()
         except (KeyboardInterrupt, SystemExit):
             self.stop()
+        else:
+            # The accepting loop has exited, so every accepted connection is
+            # already queued ahead of the shutdown requests.
+            sock, self.socket = self.socket, None
+            self.stop()
+            if sock is not None:
+                sock.close()
+
+class PreforkSupervisor(object):
+    """Runs a server in several forked worker processes, respawning them as
+    they exit.
+
+    Unless ``reuse_port`` is set, the master binds the listening socket once
+    and every worker accepts on the inherited socket; otherwise each worker
+    binds its own socket with SO_REUSEPORT and the kernel balances new
+    connections between them. ``postfork`` is called in each worker before
+    it begins serving.
+    """
+
+    respawn_delay = 1
+    """Seconds to wait before respawning a worker which exited quickly."""
+
+    def __init__(self, server, workers, reuse_port=False, postfork=None):
+        self.server = server
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.postfork = postfork
+        self.children = {}
+        self.stopping = False
+
+    def run(self, onready=None):
+        """Spawn the workers and supervise them until signalled to stop.
+
+        If given, ``onready`` is called once the workers have been spawned.
+        """
+        server = self.server
+        server.multiprocess = True
+        if self.reuse_port:
+            server.reuse_port = True
+        elif server.socket is None:
+            server.prepare()
+
+        handlers = {}
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, self._signal_stop)
+
+        try:
+            for i in range(self.workers):
+                self.spawn()
+            if onready:
+                onready()
+
+            while not self.stopping:
+                try:
+                    pid, status = os.wait()
+                except OSError:
+                    x = sys.exc_info()[1]
+                    if x.errno == errno.EINTR:
+                        continue
+                    raise
+
+                started = self.children.pop(pid, None)
+                if started is None or self.stopping:
+                    continue
+
+                server.error_log("worker %d exited with status %d; respawning"
+                                 % (pid, status), level=logging.WARNING)
+                if time.time() - started < self.respawn_delay:
+                    time.sleep(self.respawn_delay)
+                if not self.stopping:
+                    self.spawn()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.stop()
+
+    def spawn(self):
+        """Fork a single worker process."""
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return pid
+
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, self._signal_drain)
+            if self.postfork:
+                self.postfork()
+            self.server.serve()
+        except BaseException:
+            self.server.error_log("worker %d failed" % os.getpid(),
+                                  level=logging.ERROR, traceback=True)
+            status = 1
+
+        # os._exit() skips the exit handlers a worker's components may have
+        # registered, such as ones which flush writes still queued.
+        try:
+            atexit._run_exitfuncs()
+        except BaseException:
+            status = 1
+        os._exit(status)
+
+    def stop(self, timeout=None):
+        """Terminate every worker, waiting up to the server shutdown timeout."""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.pop(pid, None)
+
+        if timeout is None:
+            # Leave the workers time to stop their own thread pools.
+            timeout = self.server.shutdown_timeout + 1
+        endtime = time.time() + timeout
+        while self.children:
+            for pid in list(self.children):
+                try:
+                    reaped, status = os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    reaped = pid
+                if reaped:
+                    self.children.pop(pid, None)
+
+            if self.children and time.time() >= endtime:
+                for pid in self.children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                    except OSError:
+                        pass
+                self.children = {}
+            elif self.children:
+                time.sleep(0.1)
+
+        sock = self.server.socket
+        if sock is not None:
+            sock.close()
+            self.server.socket = None
+
+    def _signal_drain(self, signum, frame):
+        self.server.drain()
+
+    def _signal_stop(self, signum, frame):
+        self.stopping = True
+
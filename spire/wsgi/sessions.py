@@ -1,39 +1,444 @@
+import atexit
+import cPickle
+import fcntl
+import hashlib
+import sqlite3
 from datetime import datetime
+from errno import EEXIST, ENOENT
+from random import getrandbits
+from threading import Lock, Thread, local
+from time import sleep, time
 
-from scheme import Boolean, Integer, Object, Structure, Text
+from scheme import Boolean, Float, Integer, Object, Structure, Text
 from werkzeug.contrib.sessions import FilesystemSessionStore, SessionStore, Session, generate_key
 from werkzeug.http import dump_cookie, parse_cookie
 from werkzeug.wsgi import ClosingIterator
 import pickle
-from spire.core import Configuration, Unit, configured_property
+from spire.core import Configuration, Dependency, Unit, configured_property
+from spire.support.cache import LRUCache
+from spire.support.logs import LogHelper
+from spire.support.threadpool import ThreadPool
 from spire.util import pruned
-from spire.wsgi.util import Middleware
+from spire.wsgi.util import Middleware, get_environ_index, set_environ_item
 import os
 LONG_AGO = datetime(2000, 1, 1)
 
+log = LogHelper('spire.wsgi')
+
 class Session(Session):
     def __init__(self, data, sid, new=False):
         super(Session, self).__init__(data, sid, new)
         self.expired = False
+        self.indexed_user_id = get_session_user_id(self)
 
     def expire(self):
         self.expired = True
 
     def rekey(self):
         self.sid = generate_key()
+        self.indexed_user_id = None
 
     def touchSessionFile(self, store):
         touchsessionfile(store, self.sid)
 
+class LazySession(object):
+    """A proxy for the session identified by ``id``, which defers calling
+    ``loader`` to load it until it is first used.
+
+    Whether the session is new and its id can be had without loading it,
+    provided ``id`` is valid."""
+
+    __slots__ = ('id', 'loader', 'session', 'valid')
+
+    def __init__(self, loader, id, valid):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'loader', loader)
+        object.__setattr__(self, 'session', None)
+        object.__setattr__(self, 'valid', valid)
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def __delitem__(self, key):
+        del self.load()[key]
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __repr__(self):
+        if self.session is not None:
+            return repr(self.session)
+        return '<%s %r>' % (type(self).__name__, self.id)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+    def __setitem__(self, key, value):
+        self.load()[key] = value
+
+    @property
+    def loaded(self):
+        return self.session is not None
+
+    @property
+    def new(self):
+        if self.session is not None:
+            return self.session.new
+        return not self.valid
+
+    @property
+    def sid(self):
+        if self.session is None and self.valid:
+            return self.id
+        return self.load().sid
+
+    def load(self):
+        session = self.session
+        if session is None:
+            session = self.loader(self.id)
+            object.__setattr__(self, 'session', session)
+        return session
+
+class SessionIndex(object):
+    """An index of the ids of the sessions belonging to each user.
+
+    Each entry is an empty file at ``<digest[:2]>/<digest>/<sid>`` beneath
+    ``path``, where ``digest`` is a hash of the user id, so that the sessions
+    of a user can be listed without reading any session. Entries may outlive
+    their sessions, so consumers must confirm the owner of a session before
+    acting upon it."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def add(self, user_id, sid):
+        directory = self._locate(user_id)
+        try:
+            os.makedirs(directory)
+        except OSError, exception:
+            if exception.errno != EEXIST:
+                raise
+        open(os.path.join(directory, self._validate(sid)), 'a').close()
+
+    def discard(self, user_id, sid):
+        try:
+            os.unlink(os.path.join(self._locate(user_id), self._validate(sid)))
+        except OSError, exception:
+            if exception.errno != ENOENT:
+                raise
+
+    def find(self, user_id):
+        try:
+            return os.listdir(self._locate(user_id))
+        except OSError:
+            return []
+
+    def rebuild(self, store):
+        """Rebuilds this index from every session in ``store``, returning the
+        number of sessions indexed."""
+
+        owners = {}
+        for sid in store.list():
+            user_id = get_session_user_id(store.get(sid))
+            if user_id:
+                owners[sid] = self._digest(user_id)
+                self.add(user_id, sid)
+
+        for shard in self._listdir(self.path):
+            for digest in self._listdir(os.path.join(self.path, shard)):
+                directory = os.path.join(self.path, shard, digest)
+                for sid in self._listdir(directory):
+                    owner = owners.get(sid)
+                    if owner is None:
+                        # sessions saved since the scan began are checked anew
+                        user_id = get_session_user_id(store.get(sid))
+                        if user_id:
+                            owner = self._digest(user_id)
+                    if owner != digest:
+                        try:
+                            os.unlink(os.path.join(directory, sid))
+                        except OSError:
+                            pass
+        return len(owners)
+
+    def update(self, session):
+        """Indexes ``session`` under its user, if it has acquired one since it
+        was loaded."""
+
+        user_id = get_session_user_id(session)
+        if user_id and user_id != session.indexed_user_id:
+            self.add(user_id, session.sid)
+            session.indexed_user_id = user_id
+
+    def _digest(self, user_id):
+        if isinstance(user_id, unicode):
+            user_id = user_id.encode('utf8')
+        return hashlib.sha1(str(user_id)).hexdigest()
+
+    def _listdir(self, path):
+        try:
+            return os.listdir(path)
+        except OSError:
+            return []
+
+    def _locate(self, user_id):
+        digest = self._digest(user_id)
+        return os.path.join(self.path, digest[:2], digest)
+
+    def _validate(self, sid):
+        if not sid or os.sep in sid or sid[0] == '.':
+            raise ValueError(sid)
+        return sid
+
+class SQLiteSessionIndex(object):
+    """The user index of a SQLiteSessionStore, which keeps the user of each
+    session in a column of its table."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def add(self, user_id, sid):
+        pass
+
+    def discard(self, user_id, sid):
+        pass
+
+    def find(self, user_id):
+        cursor = self.store.execute('select sid from sessions where user_id = ?', (user_id,))
+        return [row[0] for row in cursor]
+
+    def rebuild(self, store):
+        owners = []
+        for sid, data in self.store.execute('select sid, data from sessions'):
+            try:
+                owners.append((get_session_user_id(cPickle.loads(str(data))), sid))
+            except Exception:
+                pass
+
+        connection = self.store.connect()
+        with connection:
+            connection.executemany('update sessions set user_id = ? where sid = ?', owners)
+        return len([user_id for user_id, sid in owners if user_id])
+
+    def update(self, session):
+        pass
+
+class SQLiteSessionStore(SessionStore):
+    """A session store backed by a single SQLite database in WAL mode, which
+    can be shared by every process on a host.
+
+    Each save stamps a session with a new version. Serialized sessions are
+    kept in a per-process LRU cache of ``cache_size`` entries, and a cached
+    session is only used after confirming that its version is still current,
+    which doesn't require reading the session from the database."""
+
+    schema = [
+        'create table if not exists sessions (sid text primary key, data blob not null,'
+            ' version integer not null, user_id, modified real not null)',
+        'create index if not exists sessions_user_id on sessions (user_id)',
+        'create index if not exists sessions_modified on sessions (modified)',
+    ]
+
+    def __init__(self, path, session_class=None, cache_size=1024, timeout=5.0):
+        SessionStore.__init__(self, session_class)
+        self.cache = None
+        if cache_size:
+            self.cache = LRUCache(cache_size)
+
+        self.connections = local()
+        self.index = SQLiteSessionIndex(self)
+        self.path = path
+        self.timeout = timeout
+
+        connection = self._connect()
+        try:
+            for statement in self.schema:
+                connection.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def delete(self, session):
+        self.execute('delete from sessions where sid = ?', (session.sid,), True)
+        if self.cache:
+            self.cache.pop(session.sid)
+
+    def connect(self):
+        """Returns the connection of the calling thread, which is opened anew
+        in a forked process."""
+
+        connections = self.connections
+        connection = getattr(connections, 'connection', None)
+        if connection is None or connections.pid != os.getpid():
+            connection = connections.connection = self._connect()
+            connections.pid = os.getpid()
+        return connection
+
+    def execute(self, sql, params=(), commit=False):
+        connection = self.connect()
+        cursor = connection.execute(sql, params)
+        if commit:
+            connection.commit()
+        return cursor
+
+    def get(self, sid):
+        if not self.is_valid_key(sid):
+            return self.new()
+
+        cache = self.cache
+        cached = None
+        if cache:
+            cached = cache.get(sid)
+
+        row = self.execute('select version, case when version = ? then null else data end'
+            ' from sessions where sid = ?', (cached and cached[0], sid)).fetchone()
+        if row is None:
+            return self.session_class({}, sid, False)
+
+        if row[1] is None:
+            serialized = cached[1]
+        else:
+            serialized = str(row[1])
+            if cache:
+                cache.put(sid, (row[0], serialized))
+
+        try:
+            data = cPickle.loads(serialized)
+        except Exception:
+            data = {}
+        return self.session_class(data, sid, False)
+
+    def list(self):
+        return [row[0] for row in self.execute('select sid from sessions')]
+
+    def save(self, session):
+        data = cPickle.dumps(dict(session), cPickle.HIGHEST_PROTOCOL)
+        version = getrandbits(62)
+
+        self.execute('insert or replace into sessions (sid, data, version, user_id, modified)'
+            ' values (?, ?, ?, ?, ?)', (session.sid, sqlite3.Binary(data), version,
+            get_session_user_id(session), time()), True)
+        if self.cache:
+            self.cache.put(session.sid, (version, data))
+
+    def expire(self, cutoff, limit):
+        """Deletes up to ``limit`` sessions last modified before ``cutoff``,
+        returning the number deleted."""
+
+        cursor = self.execute('delete from sessions where sid in (select sid from sessions'
+            ' where modified < ? limit ?)', (cutoff, limit), True)
+        return cursor.rowcount
+
+    def touch(self, sid):
+        self.execute('update sessions set modified = ? where sid = ?', (time(), sid), True)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.execute('pragma journal_mode = wal')
+        connection.execute('pragma synchronous = normal')
+        return connection
+
+class SessionWriter(object):
+    """Saves and deletes sessions on a background thread.
+
+    Sessions are queued by id, so that several saves of a session within
+    ``interval`` seconds are written once. Until then, ``get()`` returns the
+    queued state of a session so that this process sees its own writes.
+
+    The thread is started by the first write in each process, so that a
+    writer constructed before worker processes are forked works in each of
+    them."""
+
+    def __init__(self, save, delete, interval=1.0):
+        self.delete_session = delete
+        self.guard = Lock()
+        self.interval = interval
+        self.pending = {}
+        self.pid = None
+        self.save_session = save
+        self.starting = Lock()
+        self.thread = None
+        atexit.register(self.flush)
+
+    def delete(self, session):
+        copy = session.__class__({}, session.sid)
+        copy.indexed_user_id = session.indexed_user_id
+        self._enqueue(copy, False)
+
+    def flush(self):
+        with self.guard:
+            pending, self.pending = self.pending, {}
+
+        for saving, session in pending.itervalues():
+            try:
+                if saving:
+                    self.save_session(session)
+                else:
+                    self.delete_session(session)
+            except Exception:
+                log('exception', 'write-behind of session %s raised exception', session.sid)
+
+    def get(self, sid):
+        with self.guard:
+            queued = self.pending.get(sid)
+        if queued:
+            return self._copy(queued[1])
+
+    def save(self, session):
+        self._enqueue(self._copy(session), True)
+
+    def _copy(self, session):
+        copy = session.__class__(dict(session), session.sid)
+        copy.indexed_user_id = session.indexed_user_id
+        return copy
+
+    def _enqueue(self, session, saving):
+        if self.pid != os.getpid():
+            with self.starting:
+                if self.pid != os.getpid():
+                    self._start()
+        with self.guard:
+            self.pending[session.sid] = (saving, session)
+
+    def _start(self):
+        # whatever was queued before a fork belongs to the parent process
+        self.guard = Lock()
+        self.pending = {}
+
+        self.thread = Thread(target=self._run, name='spire-session-writer')
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            self.flush()
+
 class SessionBackend(Unit):
     """A session backend."""
 
     configuration = Configuration({
+        'index_path': Text(),
         'store': Structure(
             structure={
                 FilesystemSessionStore: {
                     'path': Text(default=None),
                 },
+                SQLiteSessionStore: {
+                    'path': Text(nonempty=True),
+                    'cache_size': Integer(minimum=0, default=1024),
+                    'timeout': Float(minimum=0.0, default=5.0),
+                },
             },
             polymorphic_on=Object(name='implementation', nonnull=True),
             default={'implementation': FilesystemSessionStore},
@@ -45,8 +450,22 @@ class SessionBackend(Unit):
         store = self.configuration['store']
         self.store = store['implementation'](session_class=Session,
             **pruned(store, 'implementation'))
+        self.index = construct_session_index(self.configuration, self.store)
+
+    def rebuild_index(self):
+        if self.index:
+            return self.index.rebuild(self.store)
 
     def remove_filesession_by_user_id(self, subject_id):
+        index = self.index
+        if index:
+            for sid in index.find(subject_id):
+                session = self.store.get(sid)
+                if get_session_user_id(session) == subject_id:
+                    self.store.delete(session)
+                index.discard(subject_id, sid)
+            return
+
         fs = self.store
         list_session = fs.list()
         filename = None
@@ -63,6 +482,110 @@ class SessionBackend(Unit):
     def touchsessionfile(self, sessionid):
         touchsessionfile(self.store, sessionid)
 
+class SessionSweeper(Unit):
+    """Periodically deletes the sessions of a session backend which have not
+    been used within ``max_age`` seconds, on a thread of a thread pool.
+
+    Sessions are deleted in batches of ``batch_size``, at no more than
+    ``rate`` sessions per second. When ``lock_path`` is configured, only one
+    process at a time sweeps."""
+
+    backend = Dependency(SessionBackend)
+    threadpool = Dependency(ThreadPool)
+
+    configuration = Configuration({
+        'batch_size': Integer(minimum=1, default=500),
+        'enabled': Boolean(default=True, required=True),
+        'interval': Integer(minimum=1, default=3600),
+        'lock_path': Text(),
+        'max_age': Integer(minimum=1, nonnull=True, required=True),
+        'rate': Integer(minimum=1, default=1000),
+    })
+
+    batch_size = configured_property('batch_size')
+    enabled = configured_property('enabled')
+    max_age = configured_property('max_age')
+    rate = configured_property('rate')
+
+    def __init__(self):
+        self.statistics = None
+        if self.enabled:
+            self.threadpool.enqueue(self.run)
+
+    def run(self):
+        interval = self.configuration['interval']
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                log('exception', 'sweep of expired sessions raised exception')
+            sleep(interval)
+
+    def sweep(self):
+        """Deletes expired sessions, returning the number deleted, or None if
+        another process holds the lock."""
+
+        lock = None
+        path = self.configuration.get('lock_path')
+        if path:
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lock.close()
+                return None
+
+        try:
+            started = time()
+            store = self.backend.store
+            if hasattr(store, 'expire'):
+                count = self._sweep_batches(store, started - self.max_age)
+            else:
+                count = self._sweep_files(store, started - self.max_age)
+        finally:
+            if lock:
+                lock.close()
+
+        duration = time() - started
+        self.statistics = {'completed': time(), 'duration': duration, 'removed': count}
+        log('info', 'swept %d expired sessions in %.3fs', count, duration)
+        return count
+
+    def _sweep_batches(self, store, cutoff):
+        batch_size, count = self.batch_size, 0
+        while True:
+            started = time()
+            removed = store.expire(cutoff, batch_size)
+            count += removed
+            if removed < batch_size:
+                return count
+            self._throttle(started, removed)
+
+    def _sweep_files(self, store, cutoff):
+        batch_size, count = self.batch_size, 0
+        started, removed = time(), 0
+
+        for sid in store.list():
+            filename = store.get_session_filename(sid)
+            try:
+                if os.stat(filename).st_mtime >= cutoff:
+                    continue
+                os.unlink(filename)
+            except OSError:
+                continue
+
+            count += 1
+            removed += 1
+            if removed >= batch_size:
+                self._throttle(started, removed)
+                started, removed = time(), 0
+        return count
+
+    def _throttle(self, started, removed):
+        remaining = float(removed) / self.rate - (time() - started)
+        if remaining > 0:
+            sleep(remaining)
+
 class SessionMiddleware(Unit, Middleware):
     """A session middleware."""
 
@@ -73,51 +596,74 @@ class SessionMiddleware(Unit, Middleware):
             'max_age': Integer(minimum=0),
             'secure': Boolean(default=False),
         }, generate_default=True, required=True),
+        'index_path': Text(),
         'store': Structure(
             structure={
                 FilesystemSessionStore: {
                     'path': Text(default=None),
                 },
+                SQLiteSessionStore: {
+                    'path': Text(nonempty=True),
+                    'cache_size': Integer(minimum=0, default=1024),
+                    'timeout': Float(minimum=0.0, default=5.0),
+                },
             },
             polymorphic_on=Object(name='implementation', nonnull=True),
             default={'implementation': FilesystemSessionStore},
             required=True,
-        )
+        ),
+        'touch_interval': Integer(minimum=0, default=0),
+        'write_behind': Boolean(default=False),
+        'write_behind_interval': Float(minimum=0.0, default=1.0),
     })
 
     enabled = configured_property('enabled')
+    touch_capacity = 65536
+    touch_interval = configured_property('touch_interval')
 
     def __init__(self, prefix='HTTP_X_SPIRE_'):
         self.prefix = prefix
-        self.prefix_length = len(prefix)
 
         store = self.configuration['store']
         self.store = store['implementation'](session_class=Session,
             **pruned(store, 'implementation'))
+        self.index = construct_session_index(self.configuration, self.store)
+        self.touches = LRUCache(self.touch_capacity)
+
+        self.writer = None
+        if self.configuration.get('write_behind'):
+            self.writer = SessionWriter(self._store_session, self._discard_session,
+                self.configuration['write_behind_interval'])
 
     def dispatch(self, application, environ, start_response):
         session = None
         if self.enabled:
             session = self._get_session(environ)
 
-        environ['request.session'] = session
+        set_environ_item(environ, 'request.session', session)
         if session is None:
             return application(environ, start_response)
 
         def injecting_start_response(status, headers, exc_info=None):
-            if session.expired:
-                headers.append(('Set-Cookie', self._construct_cookie(session, True)))
-                self.store.delete(session)
-            elif session.should_save:
-                self.store.save(session)
-                headers.append(('Set-Cookie', self._construct_cookie(session)))
+            loaded = session.session
+            if loaded is None:
+                pass
+            elif loaded.expired:
+                headers.append(('Set-Cookie', self._construct_cookie(loaded, True)))
+                self._delete_session(loaded)
+            elif loaded.should_save:
+                self._save_session(loaded)
+                headers.append(('Set-Cookie', self._construct_cookie(loaded)))
             return start_response(status, headers, exc_info)
 
         try:
             return application(environ, injecting_start_response)
         finally:
-            session.touchSessionFile(self.store)
-            self.store.save_if_modified(session)
+            loaded = session.session
+            if loaded is not None and loaded.should_save:
+                self._save_session(loaded)
+            elif not session.new:
+                self._touch_session(session)
 
     def _construct_cookie(self, session, unset=False):
         params = self.configuration['cookie']
@@ -134,25 +680,81 @@ class SessionMiddleware(Unit, Middleware):
         if id is None:
             id = self._find_session_id(environ)
 
+        return LazySession(self._load_session, id, bool(id) and self.store.is_valid_key(id))
+
+    def _load_session(self, id):
         if id:
+            if self.writer:
+                session = self.writer.get(id)
+                if session is not None:
+                    return session
             return self.store.get(id)
         else:
             return self.store.new()
 
+    def _delete_session(self, session):
+        if self.writer:
+            self.writer.delete(session)
+        else:
+            self._discard_session(session)
+
+    def _discard_session(self, session):
+        self.store.delete(session)
+        if self.index and session.indexed_user_id:
+            self.index.discard(session.indexed_user_id, session.sid)
+
     def _find_session_id(self, environ):
-        prefix = self.prefix
-        length = self.prefix_length
+        headers = get_environ_index(environ).get_headers(environ, self.prefix)
+        return headers.get('session-id')
 
-        for name, value in environ.iteritems():
-            if name[:length] == prefix:
-                key = name[length:].lower().replace('_', '-')
-                if key == 'session-id':
-                    return value
+    def _save_session(self, session):
+        if self.writer:
+            self.writer.save(session)
+        else:
+            self._store_session(session)
+
+    def _store_session(self, session):
+        self.store.save(session)
+        self.touches.put(session.sid, time())
+        if self.index:
+            self.index.update(session)
+
+    def _touch_session(self, session):
+        interval = self.touch_interval
+        if interval:
+            now = time()
+            touched = self.touches.get(session.sid)
+            if touched is not None and now - touched < interval:
+                return
+            self.touches.put(session.sid, now)
+        touchsessionfile(self.store, session.sid)
+
+def construct_session_index(configuration, store):
+    index = getattr(store, 'index', None)
+    if index is not None:
+        return index
+
+    path = configuration.get('index_path')
+    if not path:
+        path = getattr(store, 'path', None)
+        if not path:
+            return None
+        path = os.path.join(path, 'session-index')
+    return SessionIndex(path)
 
 def get_session(environ):
     return environ.get('request.session')
 
+def get_session_user_id(session):
+    context = session.get('request.context')
+    if isinstance(context, dict):
+        return context.get('user-id')
+
 def touchsessionfile(store, sessionid):
+    touch = getattr(store, 'touch', None)
+    if touch:
+        return touch(sessionid)
+
     fs = store
     filename = fs.get_session_filename(sessionid)
     try:
@@ -0,0 +1,63 @@
+from scheme import Json
+from werkzeug.exceptions import MethodNotAllowed
+
+from spire.wsgi.util import Mount
+
+QUEUE_METRIC = 'spire_request_queue_seconds'
+SERVICE_METRIC = 'spire_request_service_seconds'
+
+class StatsMount(Mount):
+    """A mount which reports the latency statistics gathered by a dispatcher.
+
+    Statistics are reported as JSON, unless either ``format=prometheus`` is
+    requested or the client prefers ``text/plain``, in which case they are
+    reported in the Prometheus text exposition format."""
+
+    def __init__(self, dispatcher):
+        super(StatsMount, self).__init__()
+        self.dispatcher = dispatcher
+
+    def _dispatch_request(self, request, response):
+        if request.method != 'GET':
+            raise MethodNotAllowed(['GET'])
+
+        format = request.args.get('format')
+        if not format:
+            format = 'json'
+            if request.accept_mimetypes.best_match(['application/json',
+                    'text/plain']) == 'text/plain':
+                format = 'prometheus'
+
+        statistics = sorted(self.dispatcher.statistics.iteritems())
+        if format == 'prometheus':
+            response.mimetype = 'text/plain'
+            response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+            response.data = self._format_prometheus(statistics)
+        else:
+            response.mimetype = 'application/json'
+            response.data = Json.serialize(self._format_json(statistics))
+
+    def _format_json(self, statistics):
+        content = {}
+        for path, mount in statistics:
+            content[path] = {'queue': mount.queue.summarize(),
+                'service': mount.service.summarize()}
+        return content
+
+    def _format_prometheus(self, statistics):
+        lines = []
+        for metric, attr, description in (
+                (QUEUE_METRIC, 'queue', 'Seconds requests waited for a worker thread.'),
+                (SERVICE_METRIC, 'service', 'Seconds spent servicing requests.')):
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s histogram' % metric)
+            for path, mount in statistics:
+                histogram = getattr(mount, attr)
+                label = path.replace('\\', '\\\\').replace('"', '\\"')
+                for bound, count in histogram.cumulate():
+                    bound = ('%r' % bound) if bound is not None else '+Inf'
+                    lines.append('%s_bucket{mount="%s",le="%s"} %d'
+                        % (metric, label, bound, count))
+                lines.append('%s_sum{mount="%s"} %r' % (metric, label, histogram.sum))
+                lines.append('%s_count{mount="%s"} %d' % (metric, label, histogram.total))
+        return '\n'.join(lines) + '\n'
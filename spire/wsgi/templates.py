@@ -1,11 +1,22 @@
+import os
+
 import jinja2
-from jinja2 import ChoiceLoader, PackageLoader
+from jinja2 import ChoiceLoader, FileSystemBytecodeCache, PackageLoader, TemplateSyntaxError
 from jinja2.filters import urlize
 
 STANDARD_EXTENSIONS = ['jinja2.ext.loopcontrols', 'jinja2.ext.with_']
 
 class TemplateEnvironment(jinja2.Environment):
-    def __init__(self, paths, extensions=None):
+    """A template environment over one or more package template directories.
+
+    If ``cache_dir`` is given, compiled templates are persisted there and
+    shared between processes. ``auto_reload`` can be disabled in production
+    to skip checking each template's source for changes when it is used.
+    ``cache_size`` bounds the number of compiled templates kept in memory, as
+    in jinja2; -1 keeps every one, which precompiling templates relies on."""
+
+    def __init__(self, paths, extensions=None, cache_dir=None, auto_reload=True,
+            cache_size=50):
         loaders = []
         for path in paths:
             loaders.append(PackageLoader(*path))
@@ -18,7 +29,29 @@ class TemplateEnvironment(jinja2.Environment):
         extensions = set(extensions or [])
         extensions.update(STANDARD_EXTENSIONS)
 
-        super(TemplateEnvironment, self).__init__(loader=loader, extensions=extensions)
+        bytecode_cache = None
+        if cache_dir:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+        super(TemplateEnvironment, self).__init__(loader=loader, extensions=extensions,
+            bytecode_cache=bytecode_cache, auto_reload=auto_reload, cache_size=cache_size)
+
+    def precompile(self):
+        """Compiles every template, so that later renders (including those in
+        forked processes) use the compiled code; returns the number compiled."""
+
+        count = 0
+        for name in self.list_templates():
+            try:
+                self.get_template(name)
+            except (TemplateSyntaxError, UnicodeError):
+                # Either not a template at all, or a broken one which will
+                # raise properly when it is rendered.
+                continue
+            count += 1
+        return count
 
     def render_template(self, template, context=None):
         return self.get_template(template).render(context or {})
@@ -1,11 +1,18 @@
+import fcntl
+import hashlib
 import os, json
+from errno import EEXIST, ENOENT
+from threading import BoundedSemaphore, Lock, Thread
+from time import sleep, time
 
-from scheme import Json, Text
-from werkzeug.exceptions import MethodNotAllowed
+from scheme import Integer, Json, Text
+from werkzeug.exceptions import (BadRequest, MethodNotAllowed, RequestEntityTooLarge,
+    ServiceUnavailable)
 from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
 
 from spire.core import Configuration, Unit, Dependency
+from spire.support.logs import LogHelper
 from spire.util import uniqid
 from spire.wsgi.util import Mount
 
@@ -13,41 +20,313 @@ from spire.wsgi.sessions import SessionMiddleware
 from spire.context import ContextMiddleware, HeaderParser, SessionParser
 from bastion.security.middleware import RedirectMiddleware
 
+log = LogHelper('spire.wsgi')
+
+class UploadStore(object):
+    """A content-addressed store of uploaded files.
+
+    The content of each upload is kept once per distinct hash, at
+    ``objects/<hash[:2]>/<hash[2:4]>/<hash>/content``. Every upload is a hard
+    link to that content named by its id, so the link count of the content
+    is the number of uploads sharing it, and is found through a symlink at
+    ``refs/<id[:2]>/<id>``. Files are written to ``staging`` while they are
+    being received."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.guard = Lock()
+        self.objects = os.path.join(directory, 'objects')
+        self.refs = os.path.join(directory, 'refs')
+        self.staging = os.path.join(directory, 'staging')
+
+    def commit(self, id, path, digest):
+        """Moves the staged file at ``path``, whose content hashes to ``digest``,
+        into the store as the upload ``id``."""
+
+        location = os.path.join(self.objects, digest[:2], digest[2:4], digest)
+        content = os.path.join(location, 'content')
+        link = os.path.join(location, id)
+
+        with self.guard:
+            while True:
+                self._makedirs(location)
+                try:
+                    os.link(path, content)
+                except OSError, exception:
+                    if exception.errno == ENOENT:
+                        continue
+                    elif exception.errno != EEXIST:
+                        raise
+                try:
+                    os.link(content, link)
+                except OSError, exception:
+                    if exception.errno == ENOENT:
+                        continue
+                    raise
+                break
+
+            os.unlink(path)
+            reference = self._locate(id)
+            self._makedirs(os.path.dirname(reference))
+            os.symlink(os.path.relpath(link, os.path.dirname(reference)), reference)
+
+    def dispose(self, id):
+        """Removes the upload ``id``, along with its content if no other upload
+        shares it. Returns whether the upload existed."""
+
+        reference = self._locate(id)
+        with self.guard:
+            try:
+                link = os.readlink(reference)
+            except OSError:
+                return False
+
+            link = os.path.join(os.path.dirname(reference), link)
+            os.unlink(reference)
+            try:
+                os.unlink(link)
+            except OSError:
+                pass
+
+            location = os.path.dirname(link)
+            content = os.path.join(location, 'content')
+            try:
+                if os.stat(content).st_nlink == 1:
+                    os.unlink(content)
+                    os.rmdir(location)
+            except OSError:
+                pass
+            return True
+
+    def find(self, id):
+        """Returns the path to the upload ``id``, or None."""
+
+        reference = self._locate(id)
+        if os.path.exists(reference):
+            return reference
+
+    def stage(self, id):
+        """Returns the path at which the upload ``id`` should be received."""
+
+        self._makedirs(self.staging)
+        return os.path.join(self.staging, id)
+
+    def sweep(self, ttl):
+        """Removes uploads and staged files older than ``ttl`` seconds,
+        returning the number of uploads removed."""
+
+        threshold = time() - ttl
+        count = 0
+
+        for shard in self._listdir(self.refs):
+            for id in self._listdir(os.path.join(self.refs, shard)):
+                try:
+                    modified = os.lstat(os.path.join(self.refs, shard, id)).st_mtime
+                except OSError:
+                    continue
+                if modified < threshold and self.dispose(id):
+                    count += 1
+
+        for name in self._listdir(self.staging):
+            path = os.path.join(self.staging, name)
+            try:
+                if os.stat(path).st_mtime < threshold:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+        return count
+
+    def _listdir(self, path):
+        try:
+            return os.listdir(path)
+        except OSError:
+            return []
+
+    def _locate(self, id):
+        if not id or os.sep in id or id[0] == '.':
+            raise ValueError(id)
+        return os.path.join(self.refs, id[:2], id)
+
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError, exception:
+            if exception.errno != EEXIST:
+                raise
+
+class UploadBudget(object):
+    """The number of bytes which may still be uploaded by a request."""
+
+    def __init__(self, limit=None):
+        self.remaining = limit
+
+    def consume(self, size):
+        if self.remaining is not None:
+            self.remaining -= size
+            if self.remaining < 0:
+                raise RequestEntityTooLarge()
+
+class HashingFile(object):
+    """A file being written by an upload, hashed as it is written."""
+
+    def __init__(self, path, hash='sha1', budget=None):
+        self.budget = budget
+        self.file = open(path, 'w+b')
+        self.hash = getattr(hashlib, hash)()
+        self.path = path
+        self.size = 0
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    @property
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def write(self, data):
+        if self.budget:
+            self.budget.consume(len(data))
+        self.hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
 class UploadEndpoint(Mount):
+    """An endpoint which receives files posted as multipart form data.
+
+    Each file is streamed straight into the upload directory as the request
+    body is parsed, and is hashed in the same pass. The combined size of the
+    files in a request and the number of requests being received at once can
+    both be limited; the ordinary fields of a request, which are held in
+    memory, are limited by ``max_form_memory_size`` and by what remains of
+    ``max_request_size`` when they are parsed."""
+
     session_middleware = Dependency(SessionMiddleware)
     context_middleware = ContextMiddleware([HeaderParser(), SessionParser()])
     redirect_middleware = Dependency(RedirectMiddleware)
 
     configuration = Configuration({
+        'hash': Text(nonempty=True, default='sha1'),
+        'max_concurrent_uploads': Integer(minimum=1),
+        'max_form_memory_size': Integer(minimum=0),
+        'max_request_size': Integer(minimum=0),
         'upload_directory': Text(nonempty=True, default='/tmp'),
     })
 
+    def __init__(self):
+        super(UploadEndpoint, self).__init__()
+        self.slots = None
+        self.store = UploadStore(self.configuration['upload_directory'])
+
+        limit = self.configuration.get('max_concurrent_uploads')
+        if limit:
+            self.slots = BoundedSemaphore(limit)
+
     def _dispatch_request(self, request, response):
-        directory = self.configuration['upload_directory']
         if request.method == 'GET':
             return
         elif request.method != 'POST':
             raise MethodNotAllowed()
 
+        slots = self.slots
+        if slots and not slots.acquire(False):
+            raise ServiceUnavailable()
+
+        try:
+            files = self._receive_files(request)
+        finally:
+            if slots:
+                slots.release()
+
         mapping = {}
-        for name, uploaded_file in request.files.iteritems():
-            filename = mapping[name] = '%s_%s' % (
-                uniqid(), secure_filename(uploaded_file.filename))
-            uploaded_file.save(os.path.join(directory, filename))
+        for name, uploaded_file in files.iteritems():
+            mapping[name] = os.path.basename(uploaded_file.stream.path)
 
         response.mimetype = 'text/html'
         response.data = Json.serialize(mapping)
 
+    def _receive_files(self, request):
+        hash = self.configuration['hash']
+        store = self.store
+
+        limit = self.configuration.get('max_request_size')
+        if limit is not None and request.content_length > limit:
+            raise RequestEntityTooLarge()
+
+        budget = UploadBudget(limit)
+        streams = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            id = '%s_%s' % (uniqid(), secure_filename(filename or ''))
+            stream = HashingFile(store.stage(id), hash, budget)
+            streams.append(stream)
+            return stream
+
+        try:
+            try:
+                stream, form, files = parse_form_data(request.environ,
+                    stream_factory=stream_factory, silent=False,
+                    max_form_memory_size=self._max_form_memory_size(limit),
+                    max_content_length=limit)
+            except ValueError:
+                raise BadRequest()
+
+            # only files which were received completely are committed
+            received = set(id(uploaded_file.stream)
+                for name, uploaded_file in files.iteritems(multi=True))
+            for stream in streams:
+                stream.close()
+                if id(stream) in received:
+                    store.commit(os.path.basename(stream.path), stream.path, stream.digest)
+                else:
+                    os.unlink(stream.path)
+        except Exception:
+            for stream in streams:
+                stream.close()
+                try:
+                    os.unlink(stream.path)
+                except OSError:
+                    pass
+            raise
+        return files
+
+    def _max_form_memory_size(self, limit):
+        size = self.configuration.get('max_form_memory_size')
+        if limit is not None and (size is None or size > limit):
+            size = limit
+        return size
+
 class UploadManager(Unit):
+    """Provides access to files received by an UploadEndpoint.
+
+    When ``ttl`` is configured, a background thread removes uploads which
+    have not been disposed of within that many seconds. The thread is
+    started when the manager is built and again by the first use of the
+    manager in each forked process; when ``lock_path`` is configured, only
+    one process at a time sweeps."""
+
     configuration = Configuration({
+        'lock_path': Text(),
+        'sweep_interval': Integer(minimum=1, default=300),
+        'ttl': Integer(minimum=1),
         'upload_directory': Text(nonempty=True, default='/tmp'),
     })
 
+    def __init__(self):
+        self.store = UploadStore(self.configuration['upload_directory'])
+        self.pid = None
+        self.starting = Lock()
+        self.sweeper = None
+        self._start_sweeper()
+
     def acquire(self, id):
         return open(self.find(id))
 
     def dispose(self, id):
+        self._start_sweeper()
         try:
+            if self.store.dispose(id):
+                return
             filename = self.find(id)
         except ValueError:
             pass
@@ -55,8 +334,59 @@ class UploadManager(Unit):
             os.unlink(filename)
 
     def find(self, id):
+        self._start_sweeper()
+        filename = self.store.find(id)
+        if filename:
+            return filename
+
+        # Uploads received before the store was introduced are kept flat.
         filename = os.path.join(self.configuration['upload_directory'], id)
-        if os.path.exists(filename):
+        if os.path.isfile(filename):
             return filename
         else:
             raise ValueError(id)
+
+    def sweep(self):
+        """Removes expired uploads, returning the number removed, or None if
+        another process holds the lock."""
+
+        lock = None
+        path = self.configuration.get('lock_path')
+        if path:
+            lock = open(path, 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lock.close()
+                return None
+
+        try:
+            started = time()
+            count = self.store.sweep(self.configuration['ttl'])
+        finally:
+            if lock:
+                lock.close()
+
+        if count:
+            log('info', 'swept %d expired uploads in %.3fs', count, time() - started)
+        return count
+
+    def _start_sweeper(self):
+        if not self.configuration.get('ttl') or self.pid == os.getpid():
+            return
+
+        with self.starting:
+            if self.pid != os.getpid():
+                self.sweeper = Thread(target=self._run_sweeper, name='spire-upload-sweeper')
+                self.sweeper.setDaemon(True)
+                self.sweeper.start()
+                self.pid = os.getpid()
+
+    def _run_sweeper(self):
+        interval = self.configuration['sweep_interval']
+        while True:
+            sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                log('exception', 'sweep of expired uploads raised exception')
@@ -1,13 +1,113 @@
+from time import time
+
 from scheme import Boolean, Sequence, Text
 from werkzeug.exceptions import BadRequest, HTTPException, InternalServerError, NotFound
 from werkzeug.wrappers import Request, Response
 
 from spire.core import Configuration, Unit
 from spire.local import ContextLocals
+from spire.support.cache import LRUCache
 from spire.support.logs import LogHelper
+from spire.support.metrics import Histogram
 
 log = LogHelper('spire.wsgi')
 
+class EnvironIndex(object):
+    """An index of the entries of a WSGI environ which spire consults on every
+    request: request attributes (``request.*`` keys) and custom headers
+    (``HTTP_X_*`` keys).
+
+    The index records the names of those entries in a single pass over the
+    environ the first time it is needed, and is stored in the environ so that
+    it is shared by the middleware and the request. Values are always read
+    from the environ itself, so overwritten entries are never stale. Entries
+    should be added with ``set_environ_item()``; the environ is scanned again
+    if anything else has grown or shrunk it since, if an indexed entry has
+    been removed, or if the index is found in a copy of the environ it was
+    built for."""
+
+    key = 'spire.index'
+
+    def __init__(self, environ):
+        self._scan(environ)
+
+    def get_attributes(self, environ):
+        self._validate(environ)
+        try:
+            return self._get_attributes(environ)
+        except KeyError:
+            self._scan(environ)
+            return self._get_attributes(environ)
+
+    def get_headers(self, environ, prefix):
+        """Returns the headers with the given environ prefix, keyed by their
+        lowercased, hyphenated names with the prefix removed."""
+
+        self._validate(environ)
+        try:
+            return self._get_headers(environ, prefix)
+        except KeyError:
+            self._scan(environ)
+            return self._get_headers(environ, prefix)
+
+    def _get_attributes(self, environ):
+        attributes = {}
+        for name in self.attributes:
+            attributes[name[8:]] = environ[name]
+        return attributes
+
+    def _get_headers(self, environ, prefix):
+        try:
+            names = self.prefixed[prefix]
+        except KeyError:
+            candidates = self.headers
+            if prefix[:7] != 'HTTP_X_':
+                candidates = environ
+
+            length = len(prefix)
+            names = self.prefixed[prefix] = [(name, name[length:].lower().replace('_', '-'))
+                for name in candidates if name[:length] == prefix]
+
+        headers = {}
+        for name, header in names:
+            headers[header] = environ[name]
+        return headers
+
+    def set(self, environ, key, value):
+        current = (id(environ) == self.identity and len(environ) == self.size)
+        added = (key not in environ)
+
+        environ[key] = value
+        if not (current and added):
+            return
+
+        self.size += 1
+        self.prefixed = {}
+        if key[:8] == 'request.':
+            self.attributes.append(key)
+        elif key[:7] == 'HTTP_X_':
+            self.headers.append(key)
+
+    def _scan(self, environ):
+        attributes = []
+        headers = []
+
+        for name in environ:
+            if name[:8] == 'request.':
+                attributes.append(name)
+            elif name[:7] == 'HTTP_X_':
+                headers.append(name)
+
+        self.attributes = attributes
+        self.headers = headers
+        self.identity = id(environ)
+        self.prefixed = {}
+        self.size = len(environ) + (self.key not in environ)
+
+    def _validate(self, environ):
+        if id(environ) != self.identity or len(environ) != self.size:
+            self._scan(environ)
+
 class Mount(Unit):
     configuration = Configuration({
         'middleware': Sequence(Text(nonempty=True), unique=True),
@@ -73,36 +173,54 @@ class Middleware(object):
     def wrap(self, application):
         return MiddlewareWrapper(self, application)
 
+class MountStatistics(object):
+    """Latency statistics for a single mount."""
+
+    def __init__(self):
+        self.queue = Histogram()
+        self.service = Histogram()
+
 class MountDispatcher(object):
+    """Dispatches each request to the mount with the longest path which is
+    a prefix of the request path, at a segment boundary.
+
+    Mount paths are compiled into a table ordered from longest to shortest,
+    and the outcome of recent lookups is cached by request path."""
+
+    cache_size = 256
+
     def __init__(self, mounts=None):
+        self.cache = LRUCache(self.cache_size)
         self.mounts = {}
+        self.statistics = {}
+        self.table = ()
         if mounts:
             for mount in mounts:
                 self.mount(mount)
 
     def dispatch(self, environ, start_response):
-        script = environ.get('PATH_INFO', '')
-        pathinfo = ''
-
-        mounts = self.mounts
-        while '/' in script:
-            try:
-                mount = mounts[script]
-            except KeyError:
-                segments = script.split('/')
-                script = '/'.join(segments[:-1])
-                pathinfo = '/%s%s' % (segments[-1], pathinfo)
-            else:
-                break
-        else:
-            try:
-                mount = mounts['/']
-            except KeyError:
-                return NotFound()(environ, start_response)
+        path = environ.get('PATH_INFO', '')
+        match = self.cache.get(path)
+        if match is None:
+            match = self._match(path)
+            self.cache.put(path, match)
+
+        mount, length, statistics = match
+        if mount is None:
+            return NotFound()(environ, start_response)
 
         environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + mount.unshared_path
-        environ['PATH_INFO'] = mount.shared_path + pathinfo
-        return mount(environ, start_response)
+        environ['PATH_INFO'] = mount.shared_path + path[length:]
+
+        queue_wait = environ.get('spire.queue_wait')
+        if queue_wait is not None:
+            statistics.queue.record(queue_wait)
+
+        started = time()
+        try:
+            return mount(environ, start_response)
+        finally:
+            statistics.service.record(time() - started)
 
     __call__ = dispatch
 
@@ -110,10 +228,45 @@ class MountDispatcher(object):
         path = mount.path
         if path not in self.mounts:
             self.mounts[path] = mount
+            self.statistics[path] = MountStatistics()
         else:
             log('warning', 'mount %r declares duplicate path %r', mount, path)
+            return
+
+        table = [(prefix, len(prefix), unit, self.statistics[prefix])
+            for prefix, unit in self.mounts.iteritems()]
+        table.sort(key=lambda entry: entry[1], reverse=True)
+
+        self.table = tuple(table)
+        self.cache.clear()
+
+    def _match(self, path):
+        size = len(path)
+        for prefix, length, mount, statistics in self.table:
+            if (length <= size and path.startswith(prefix)
+                    and (length == size or path[length] == '/')):
+                return mount, length, statistics
+
+        mount = self.mounts.get('/')
+        if mount is not None:
+            return mount, 0, self.statistics['/']
+        return None, 0, None
+
+def get_environ_index(environ):
+    index = environ.get(EnvironIndex.key)
+    if index is None:
+        index = environ[EnvironIndex.key] = EnvironIndex(environ)
+    return index
 
 def redirect_response(response, url, status=302):
     response.status_code = status
     response.headers.add('Location', url)
     return response
+
+def set_environ_item(environ, key, value):
+    """Sets ``key`` in ``environ``, keeping its index, if any, up to date."""
+    index = environ.get(EnvironIndex.key)
+    if index is not None:
+        index.set(environ, key, value)
+    else:
+        environ[key] = value
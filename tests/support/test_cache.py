@@ -0,0 +1,86 @@
+from threading import Thread
+
+from unittest2 import TestCase
+
+from spire.support.cache import LRUCache
+
+class TestLRUCache(TestCase):
+    def test_get_and_put(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 0), 0)
+
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertIn('a', cache)
+        self.assertEqual(len(cache), 2)
+
+        cache.put('a', 3)
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('c', 3)
+        self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 2)
+
+        cache.get('b')
+        cache.put('d', 4)
+        self.assertNotIn('c', cache)
+        self.assertEqual(cache.get('b'), 2)
+
+        cache.put('b', 5)
+        cache.put('e', 6)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.get('b'), 5)
+
+    def test_pop(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEqual(cache.pop('a', 0), 0)
+
+        cache.put('c', 3)
+        cache.put('d', 4)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get('a'))
+
+        cache.put('b', 2)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_concurrent_access(self):
+        cache = LRUCache(16)
+        def run(offset):
+            for i in range(2000):
+                key = (offset + i) % 64
+                cache.put(key, i)
+                cache.get((key + 1) % 64)
+                if not i % 7:
+                    cache.pop(key)
+
+        threads = [Thread(target=run, args=(i * 5,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(len(cache), 16)
+        for key in range(64):
+            cache.put(key, key)
+        self.assertEqual(len(cache), 16)
+        self.assertEqual(sorted(cache.entries), range(48, 64))
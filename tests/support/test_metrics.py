@@ -0,0 +1,48 @@
+from unittest2 import TestCase
+
+from spire.support.metrics import Histogram
+
+class TestHistogram(TestCase):
+    def test_empty(self):
+        histogram = Histogram((0.1, 1.0))
+        self.assertEqual(histogram.percentile(50), 0.0)
+        self.assertEqual(histogram.cumulate(), [(0.1, 0), (1.0, 0), (None, 0)])
+        self.assertEqual(histogram.summarize(), {'count': 0, 'sum': 0.0, 'max': 0.0,
+            'p50': 0.0, 'p95': 0.0, 'p99': 0.0})
+
+    def test_record(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.record(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.total, 4)
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        self.assertEqual(histogram.maximum, 2.0)
+        self.assertEqual(histogram.cumulate(), [(0.1, 2), (1.0, 3), (None, 4)])
+
+    def test_percentile(self):
+        histogram = Histogram((0.1, 1.0))
+        for i in range(100):
+            histogram.record(0.5)
+
+        self.assertAlmostEqual(histogram.percentile(50), 0.3)
+        self.assertAlmostEqual(histogram.percentile(100), 0.5)
+
+        histogram.record(5.0)
+        self.assertAlmostEqual(histogram.percentile(100), 5.0)
+        self.assertLessEqual(histogram.percentile(99), 1.0)
+
+    def test_summarize(self):
+        histogram = Histogram()
+        for i in range(1, 101):
+            histogram.record(i / 1000.0)
+
+        summary = histogram.summarize()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['sum'], 5.05)
+        self.assertEqual(summary['max'], 0.1)
+        self.assertLessEqual(summary['p50'], summary['p95'])
+        self.assertLessEqual(summary['p95'], summary['p99'])
+        self.assertLessEqual(summary['p99'], summary['max'])
+        self.assertAlmostEqual(summary['p50'], 0.05, delta=0.01)
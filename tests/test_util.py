@@ -0,0 +1,46 @@
+from unittest2 import TestCase
+
+from spire.util import InvocationPlan, call_with_supported_params, get_supported_params
+
+def view(request, id, format=None):
+    return (request, id, format)
+
+def keywords(request, id=None, **params):
+    return (request, id, params)
+
+class Resource(object):
+    def __init__(self, id, format=None):
+        self.params = (id, format)
+
+    def __call__(self, request, format=None):
+        return (request, format)
+
+    def get(self, request, id):
+        return (request, id)
+
+class TestSupportedParams(TestCase):
+    def test_get_supported_params(self):
+        self.assertEqual(get_supported_params(view), frozenset(['request', 'id', 'format']))
+        self.assertEqual(get_supported_params(keywords), frozenset(['request', 'id']))
+        self.assertEqual(get_supported_params(Resource), frozenset(['id', 'format']))
+        self.assertEqual(get_supported_params(Resource(1)), frozenset(['request', 'format']))
+        self.assertEqual(get_supported_params(Resource(1).get), frozenset(['request', 'id']))
+        self.assertEqual(get_supported_params(Resource.get),
+            frozenset(['self', 'request', 'id']))
+
+    def test_call_with_supported_params(self):
+        self.assertEqual(call_with_supported_params(view, 'r', id=1, other=2), ('r', 1, None))
+        self.assertEqual(call_with_supported_params(keywords, 'r', id=1, other=2),
+            ('r', 1, {}))
+        self.assertEqual(call_with_supported_params(Resource, id=1, other=2).params,
+            (1, None))
+
+    def test_invocation_plan(self):
+        plan = InvocationPlan(view)
+        self.assertEqual(plan('r', id=1, format='json', other=2), ('r', 1, 'json'))
+
+        plan = InvocationPlan(keywords)
+        self.assertEqual(plan('r', id=1, other=2), ('r', 1, {}))
+
+        plan = InvocationPlan(Resource(1).get)
+        self.assertEqual(plan('r', id=1, format='json'), ('r', 1))
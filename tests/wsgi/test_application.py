@@ -0,0 +1,84 @@
+from unittest2 import TestCase
+
+from werkzeug.test import create_environ
+from werkzeug.wrappers import Request, Response
+
+from spire.wsgi.application import CacheMediator, cached
+
+class StubApplication(object):
+    def __init__(self, **views):
+        self.views = views
+
+class TestCacheMediator(TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def _view(self, headers=None):
+        @cached(ttl=60)
+        def view(request):
+            self.calls.append(request)
+            return Response('content %d' % len(self.calls), headers=headers)
+        return view
+
+    def _request(self, mediator, view, headers=None):
+        request = Request(create_environ('/page', headers=headers or {}))
+        request.application = StubApplication(page=view)
+        request.endpoint = 'page'
+        request.match = lambda: None
+
+        response = mediator.mediate_request(request)
+        if response is None:
+            response = mediator.mediate_response(request, view(request))
+        return response
+
+    def test_caching(self):
+        mediator, view = CacheMediator(), self._view()
+        first = self._request(mediator, view)
+        second = self._request(mediator, view)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second.data, first.data)
+
+        response = self._request(mediator, view, {'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_set_cookie_not_stored(self):
+        mediator, view = CacheMediator(), self._view([('Set-Cookie', 'sid=abc')])
+        first = self._request(mediator, view)
+        self.assertEqual(first.headers.get('Set-Cookie'), 'sid=abc')
+
+        second = self._request(mediator, view)
+        self.assertEqual(len(self.calls), 1)
+        self.assertIsNone(second.headers.get('Set-Cookie'))
+
+    def test_private_responses_not_cached(self):
+        for value in ('private', 'no-store'):
+            mediator, view = CacheMediator(), self._view([('Cache-Control', value)])
+            self._request(mediator, view)
+            self._request(mediator, view)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_credentialed_requests_not_cached(self):
+        for header in ('Cookie', 'Authorization'):
+            mediator, view = CacheMediator(), self._view()
+            self._request(mediator, view, {header: 'alice'})
+            self._request(mediator, view, {header: 'alice'})
+        self.assertEqual(len(self.calls), 4)
+
+    def test_credentialed_requests_cached_when_varied(self):
+        mediator, view = CacheMediator(vary=['Cookie']), self._view()
+        self._request(mediator, view, {'Cookie': 'sid=alice'})
+        self._request(mediator, view, {'Cookie': 'sid=alice'})
+        self.assertEqual(len(self.calls), 1)
+
+        response = self._request(mediator, view, {'Cookie': 'sid=bob'})
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(response.data, 'content 2')
+
+    def test_weak_if_none_match(self):
+        mediator, view = CacheMediator(), self._view()
+        etag = self._request(mediator, view).headers['ETag']
+        self._request(mediator, view)
+
+        response = self._request(mediator, view, {'If-None-Match': 'W/' + etag})
+        self.assertEqual(response.status_code, 304)
@@ -0,0 +1,80 @@
+from httplib import HTTPConnection
+from StringIO import StringIO
+from threading import Thread
+from time import sleep
+from urllib import urlencode
+
+from unittest2 import TestCase
+
+from spire.core import *
+from spire.wsgi.clientdownload import ClientDownloadEndPoint, FormFieldReader
+from spire.wsgi.server import WsgiServer
+
+class TestFormFieldReader(TestCase):
+    def _read(self, body, chunk_size=7):
+        reader = FormFieldReader(StringIO(body), chunk_size)
+        return [(name, ''.join(values)) for name, values in reader]
+
+    def test_fields(self):
+        self.assertEqual(self._read('a=1&b+c=%41%42%43+x&d&=e&f='),
+            [(u'a', '1'), (u'b c', 'ABC x'), (u'd', ''), (u'f', '')])
+
+    def test_escapes_split_across_reads(self):
+        value = ''.join(chr(i) for i in range(256)) * 4
+        body = urlencode([('data', value), ('after', 'x')])
+        for chunk_size in (1, 2, 3, 5, 64):
+            self.assertEqual(self._read(body, chunk_size), [(u'data', value), (u'after', 'x')])
+
+    def test_unconsumed_values_are_skipped(self):
+        reader = FormFieldReader(StringIO('a=%s&b=2' % ('x' * 100)), 8)
+        self.assertEqual([name for name, values in reader], [u'a', u'b'])
+
+class TestClientDownloadEndPoint(TestCase):
+    def setUp(self):
+        Registry.purge()
+        self.server = WsgiServer(('127.0.0.1', 0), ClientDownloadEndPoint(path='/download'))
+        self.thread = Thread(target=self.server.serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        for i in range(100):
+            if self.server.ready and self.server.socket:
+                break
+            sleep(0.05)
+        self.connection = HTTPConnection('127.0.0.1', self.server.socket.getsockname()[1],
+            timeout=20)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.drain()
+        self.thread.join(10)
+
+    def _post(self, fields):
+        self.connection.request('POST', '/download', urlencode(fields),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_streamed_roundtrip_over_keepalive(self):
+        data = ''.join(chr(i) for i in range(256)) * 40
+        for i in range(2):
+            response, body = self._post([('mimetype', 'text/plain'),
+                ('filename', 'data.txt'), ('data', data), ('trailing', 'x' * 1000)])
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader('content-disposition'),
+                'attachment;filename=data.txt')
+            self.assertEqual(body, data)
+
+    def test_large_roundtrip_over_keepalive(self):
+        data = 'spire data,' * (1024 * 1024)
+        for i in range(2):
+            response, body = self._post([('mimetype', 'text/plain'),
+                ('filename', 'data.txt'), ('data', data), ('trailing', 'x' * 1000)])
+            self.assertEqual(response.status, 200)
+            self.assertEqual(len(body), len(data))
+            self.assertEqual(body, data)
+
+    def test_buffered_roundtrip(self):
+        data = 'x,y\n' * 100000
+        response, body = self._post([('data', data), ('filename', 'export.csv')])
+        self.assertEqual(response.getheader('content-type'), 'text/csv; charset=utf-8')
+        self.assertEqual(body, data)
@@ -0,0 +1,98 @@
+import zlib
+
+from unittest2 import TestCase
+from werkzeug.test import Client, create_environ
+from werkzeug.wrappers import BaseResponse
+
+from spire.core import Registry
+from spire.wsgi.compression import CompressionMiddleware
+
+CONTENT = 'spire ' * 400
+
+def application(chunks, mimetype='text/plain', length=True, status='200 OK', headers=()):
+    def serve(environ, start_response):
+        response_headers = [('Content-Type', mimetype)] + list(headers)
+        if length:
+            response_headers.append(('Content-Length', str(sum(len(c) for c in chunks))))
+        start_response(status, response_headers)
+        return iter(chunks)
+    return serve
+
+class TestCompressionMiddleware(TestCase):
+    def setUp(self):
+        Registry.purge()
+
+    def _request(self, app, encoding='gzip', method='GET', **params):
+        middleware = CompressionMiddleware(**params)
+        client = Client(middleware.wrap(app), BaseResponse)
+        headers = {}
+        if encoding:
+            headers['Accept-Encoding'] = encoding
+        return client.open('/', method=method, headers=headers)
+
+    def test_gzip(self):
+        response = self._request(application([CONTENT[:1000], CONTENT[1000:]]))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(zlib.decompress(response.data, 16 + zlib.MAX_WBITS), CONTENT)
+
+    def test_deflate(self):
+        response = self._request(application([CONTENT]), 'deflate, gzip;q=0.5')
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.data), CONTENT)
+
+    def test_existing_vary(self):
+        response = self._request(application([CONTENT], headers=[('Vary', 'Cookie')]))
+        self.assertEqual(response.headers['Vary'], 'Cookie, Accept-Encoding')
+
+    def test_unknown_length(self):
+        chunks = [CONTENT[:100], CONTENT[100:600], CONTENT[600:]]
+        response = self._request(application(chunks, length=False), minimum_size=500)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.data, 16 + zlib.MAX_WBITS), CONTENT)
+
+        response = self._request(application(['small', 'content'], length=False),
+            minimum_size=500)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, 'smallcontent')
+
+    def test_chunks_are_flushed(self):
+        middleware = CompressionMiddleware(minimum_size=0)
+        app = middleware.wrap(application([CONTENT[:100], '', CONTENT[100:]]))
+        environ = create_environ('/', headers={'Accept-Encoding': 'deflate'})
+
+        chunks = list(app(environ, lambda status, headers, exc_info=None: None))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(zlib.decompressobj().decompress(chunks[0]), CONTENT[:100])
+        self.assertEqual(zlib.decompress(''.join(chunks)), CONTENT)
+
+    def test_weakened_etag(self):
+        response = self._request(application([CONTENT], headers=[('ETag', '"abc"')]))
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+
+        response = self._request(application([CONTENT], headers=[('ETag', 'W/"abc"')]))
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+
+        response = self._request(application([CONTENT], headers=[('ETag', '"abc"')]), None)
+        self.assertEqual(response.headers['ETag'], '"abc"')
+
+    def test_uncompressed_responses(self):
+        cases = [
+            (application([CONTENT]), {'encoding': None}),
+            (application([CONTENT]), {'encoding': 'identity'}),
+            (application([CONTENT]), {'method': 'HEAD'}),
+            (application([CONTENT]), {'enabled': False}),
+            (application(['small']), {}),
+            (application([CONTENT], mimetype='image/png'), {}),
+            (application([CONTENT], headers=[('Content-Encoding', 'br')]), {}),
+            (application([CONTENT], headers=[('Cache-Control', 'no-transform')]), {}),
+            (application([CONTENT], status='206 Partial Content'), {}),
+            (application([CONTENT], headers=[('Content-Length', 'invalid')], length=False), {}),
+        ]
+
+        for app, params in cases:
+            response = self._request(app, **params)
+            self.assertNotIn('gzip', response.headers.get('Content-Encoding', ''), params)
+            if params.get('method') != 'HEAD':
+                self.assertIn(response.data, (CONTENT, 'small'))
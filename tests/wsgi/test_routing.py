@@ -0,0 +1,59 @@
+from unittest2 import TestCase
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, RequestRedirect, Rule
+
+from spire.wsgi.routing import RouteCache
+
+class TestRouteCache(TestCase):
+    def setUp(self):
+        self.urls = Map([
+            Rule('/', endpoint='index'),
+            Rule('/items', endpoint='list', methods=['GET']),
+            Rule('/items', endpoint='create', methods=['POST']),
+            Rule('/items/<int:id>', endpoint='item'),
+            Rule('/page', endpoint='page', defaults={'number': 1}),
+            Rule('/page/<int:number>', endpoint='page'),
+            Rule('/folder/', endpoint='folder'),
+        ])
+        self.routes = RouteCache(self.urls)
+
+    def _match(self, path, method='GET'):
+        adapter = self.urls.bind('localhost', path_info=path, default_method=method)
+        return self.routes.match(adapter)
+
+    def test_static_rules(self):
+        self.assertEqual(self._match('/'), ('index', {}))
+        self.assertEqual(self._match('/items'), ('list', {}))
+        self.assertEqual(self._match('/items', 'POST'), ('create', {}))
+        self.assertEqual(self._match('/items', 'HEAD'), ('list', {}))
+        self.assertIn('/items', self.routes.table)
+
+    def test_rules_with_converters(self):
+        self.assertEqual(self._match('/items/1'), ('item', {'id': 1}))
+        self.assertEqual(self._match('/items/2'), ('item', {'id': 2}))
+        self.assertEqual(len(self.routes.cache), 0)
+
+    def test_rules_with_defaults(self):
+        self.assertEqual(self._match('/page'), ('page', {'number': 1}))
+        endpoint, params = self._match('/page')
+        self.assertEqual(params, {'number': 1})
+        self.assertEqual(len(self.routes.cache), 1)
+
+        params['number'] = 2
+        self.assertEqual(self._match('/page'), ('page', {'number': 1}))
+
+    def test_errors(self):
+        self.assertRaises(NotFound, self._match, '/missing')
+        self.assertRaises(MethodNotAllowed, self._match, '/items', 'DELETE')
+        self.assertRaises(RequestRedirect, self._match, '/folder')
+        self.assertRaises(NotFound, self._match, '/missing')
+
+    def test_invalidation(self):
+        self.assertRaises(NotFound, self._match, '/added')
+        self.assertEqual(self._match('/page'), ('page', {'number': 1}))
+
+        self.urls.add(Rule('/added', endpoint='added'))
+        self.assertEqual(self._match('/added'), ('added', {}))
+        self.assertEqual(len(self.routes.cache), 0)
+        self.assertEqual(self._match('/page'), ('page', {'number': 1}))
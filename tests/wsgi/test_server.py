@@ -0,0 +1,540 @@
+import os
+import stat
+from httplib import HTTPConnection
+from shutil import rmtree
+from signal import SIGKILL, SIGTERM
+from socket import AF_INET, AF_UNIX, SOCK_STREAM, create_connection, error as socket_error, socket
+from StringIO import StringIO
+from tempfile import mkdtemp, mkstemp
+from threading import Thread
+from time import sleep
+
+from unittest2 import TestCase
+
+from spire.wsgi import server
+from spire.wsgi.server import PreforkSupervisor, WsgiServer, read_headers
+
+def slow_application(environ, start_response):
+    sleep(0.3)
+    start_response('200 OK', [('Content-Length', '2')])
+    return ['ok']
+
+class ServerTestCase(TestCase):
+    def _serve(self, application, address=('127.0.0.1', 0), **params):
+        self.server = WsgiServer(address, application, **params)
+        self.thread = Thread(target=self.server.serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        for i in range(100):
+            if self.server.ready and self.server.socket:
+                break
+            sleep(0.05)
+        if isinstance(address, tuple):
+            self.port = self.server.socket.getsockname()[1]
+
+    def tearDown(self):
+        self.server.drain()
+        self.thread.join(10)
+
+    def _request(self, path='/'):
+        connection = HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def _exchange(self, data):
+        connection = create_connection(('127.0.0.1', self.port))
+        try:
+            connection.sendall(data)
+            received = ''
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    return received
+                received += chunk
+        finally:
+            connection.close()
+
+    def _burst(self, count):
+        threads = [Thread(target=self._request) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+def echo_application(environ, start_response):
+    content = '%s %s' % (environ['PATH_INFO'], environ.get('HTTP_X_FOLDED'))
+    start_response('200 OK', [('Content-Length', str(len(content)))])
+    return [content]
+
+def ok_application(environ, start_response):
+    start_response('200 OK', [('Content-Length', '2')])
+    return ['ok']
+
+class TestKeepaliveParking(ServerTestCase):
+    def _idle(self, count):
+        for i in range(100):
+            if self.server.connections.idle == count:
+                return True
+            sleep(0.05)
+
+    def test_idle_connections_release_worker(self):
+        self._serve(ok_application, numthreads=1)
+        connections = [HTTPConnection('127.0.0.1', self.port, timeout=5) for i in range(2)]
+        try:
+            for i in range(3):
+                for connection in connections:
+                    connection.request('GET', '/')
+                    self.assertEqual(connection.getresponse().read(), 'ok')
+            self.assertTrue(self._idle(2))
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def test_idle_connections_expire(self):
+        self._serve(ok_application)
+        self.server.timeout = 1
+
+        connection = create_connection(('127.0.0.1', self.port))
+        try:
+            connection.settimeout(5)
+            connection.sendall('GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            received = ''
+            while not received.endswith('ok'):
+                received += connection.recv(65536)
+            self.assertTrue(self._idle(1))
+
+            self.assertEqual(connection.recv(65536), '')
+            self.assertEqual(self.server.connections.idle, 0)
+        finally:
+            connection.close()
+
+class TestRequestHead(ServerTestCase):
+    def setUp(self):
+        self._serve(echo_application)
+        self.server.max_request_header_size = 1024
+
+    def test_request(self):
+        received = self._exchange('GET /path HTTP/1.1\r\nHost: localhost\r\n'
+            'Connection: close\r\n\r\n')
+        self.assertTrue(received.startswith('HTTP/1.1 200 OK'))
+        self.assertTrue(received.endswith('/path None'))
+
+    def test_leading_crlf(self):
+        received = self._exchange('\r\nGET /path HTTP/1.1\r\nHost: localhost\r\n'
+            'Connection: close\r\n\r\n')
+        self.assertTrue(received.startswith('HTTP/1.1 200 OK'))
+
+    def test_folded_header(self):
+        headers = 'Host: localhost\r\nX-Folded: first\r\n\tsecond\r\nConnection: close\r\n\r\n'
+        expected = read_headers(StringIO(headers))['X-Folded']
+
+        received = self._exchange('GET /path HTTP/1.1\r\n' + headers)
+        self.assertTrue(received.startswith('HTTP/1.1 200 OK'))
+        self.assertTrue(received.endswith('/path %s' % expected))
+
+    def test_pipelined_requests(self):
+        received = self._exchange('GET /first HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            'GET /second HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        self.assertEqual(received.count('200 OK'), 2)
+        self.assertIn('/first None', received)
+        self.assertTrue(received.endswith('/second None'))
+
+    def test_bare_lf_terminators(self):
+        received = self._exchange('GET /path HTTP/1.1\nHost: localhost\n\n')
+        self.assertTrue(received.startswith('HTTP/1.1 400 Bad Request'))
+
+    def test_request_uri_too_long(self):
+        received = self._exchange('GET /%s HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            % ('x' * 2048))
+        self.assertTrue(received.startswith('HTTP/1.1 414'))
+
+    def test_headers_too_large(self):
+        received = self._exchange('GET /path HTTP/1.1\r\nHost: localhost\r\n'
+            'X-Large: %s\r\n\r\n' % ('x' * 2048))
+        self.assertTrue(received.startswith('HTTP/1.1 413'))
+
+class TestRequestBody(ServerTestCase):
+    def setUp(self):
+        self.response_size = 8 * 1024 * 1024
+        self.read_size = 0
+
+    def _application(self, environ, start_response):
+        if self.read_size:
+            environ['wsgi.input'].read(self.read_size)
+        start_response('200 OK', [('Content-Length', str(self.response_size))])
+        return ['x' * self.response_size]
+
+    def _post(self, connection, size):
+        connection.request('POST', '/', body='x' * size)
+        response = connection.getresponse()
+        return response.status, len(response.read())
+
+    def test_unread_body(self):
+        self._serve(self._application)
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            size = 16 * 1024 * 1024
+            self.assertEqual(self._post(connection, size), (200, self.response_size))
+            self.assertEqual(self._post(connection, size), (200, self.response_size))
+        finally:
+            connection.close()
+
+    def test_partially_read_body(self):
+        self.read_size, self.response_size = 1024, 2
+        self._serve(self._application)
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            self.assertEqual(self._post(connection, 65536), (200, 2))
+            self.assertEqual(self._post(connection, 65536), (200, 2))
+        finally:
+            connection.close()
+
+class TestThreadPoolScaler(ServerTestCase):
+    def test_regrows_after_shrinking(self):
+        self._serve(slow_application, numthreads=1, maxthreads=4,
+            scaling={'interval': 0.05, 'idle_timeout': 0.5})
+        pool = self.server.requests
+
+        self._burst(6)
+        self.assertEqual(len(pool._threads), 4)
+
+        sleep(3)
+        self.assertEqual(len(pool._threads), 1)
+        self.assertEqual(pool.idle, 1)
+        shrunk = self.server.stats['Threads Shrunk']
+        self.assertEqual(shrunk, 3)
+
+        grown = self.server.stats['Threads Grown']
+        self._burst(6)
+        self.assertGreater(self.server.stats['Threads Grown'], grown)
+
+class TestLoadShedding(ServerTestCase):
+    def _statuses(self, count):
+        statuses = []
+        def request():
+            statuses.append(self._request()[0])
+
+        threads = [Thread(target=request) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def test_sheds_once_pool_is_full(self):
+        self._serve(slow_application, numthreads=1, max_queue_depth=1)
+        statuses = self._statuses(8)
+        self.assertIn(503, statuses)
+        self.assertEqual(self.server.stats['Rejected Connections'], statuses.count(503))
+
+    def test_grows_before_shedding(self):
+        self._serve(slow_application, numthreads=1, maxthreads=4, max_queue_depth=1,
+            scaling={'interval': 0.05})
+        statuses = self._statuses(8)
+        self.assertGreater(self.server.stats['Threads Grown'], 0)
+        self.assertGreaterEqual(statuses.count(200), 4)
+        self.assertEqual(self.server.stats['Rejected Connections'], statuses.count(503))
+
+class TestFileWrapper(ServerTestCase):
+    def setUp(self):
+        self.content = ''.join(chr(i % 256) for i in range(300000))
+        descriptor, self.path = mkstemp()
+        os.write(descriptor, self.content)
+        os.close(descriptor)
+        self.sent = []
+        self.sendfile = server.sendfile
+
+        def sendfile(out_fd, in_fd, offset, count):
+            sent = self.sendfile(out_fd, in_fd, offset, count)
+            self.sent.append(sent)
+            return sent
+        server.sendfile = sendfile
+
+    def tearDown(self):
+        server.sendfile = self.sendfile
+        os.unlink(self.path)
+        super(TestFileWrapper, self).tearDown()
+
+    def _application(self, opener, offset=0, length=True):
+        def serve(environ, start_response):
+            headers = []
+            if length:
+                headers.append(('Content-Length', str(len(self.content) - offset)))
+            start_response('200 OK', headers)
+            filelike = opener()
+            filelike.seek(offset)
+            return environ['wsgi.file_wrapper'](filelike)
+        return serve
+
+    def _open(self):
+        return open(self.path, 'rb')
+
+    def test_sendfile(self):
+        self._serve(self._application(self._open))
+        self.assertEqual(self._request(), (200, self.content))
+        self.assertEqual(sum(self.sent), len(self.content))
+
+    def test_offset(self):
+        self._serve(self._application(self._open, 1000))
+        self.assertEqual(self._request(), (200, self.content[1000:]))
+        self.assertEqual(sum(self.sent), len(self.content) - 1000)
+
+    def test_chunked(self):
+        self._serve(self._application(self._open, length=False))
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            for i in range(2):
+                connection.request('GET', '/')
+                response = connection.getresponse()
+                self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+                self.assertEqual(response.read(), self.content)
+        finally:
+            connection.close()
+
+    def test_fallback(self):
+        self._serve(self._application(lambda: StringIO(self.content)))
+        self.assertEqual(self._request(), (200, self.content))
+        self.assertEqual(self.sent, [])
+
+class TestResponseWrites(ServerTestCase):
+    def setUp(self):
+        self.writes = []
+        self.sendall = server.CP_fileobject.sendall
+
+        def sendall(wfile, data):
+            self.writes.append(data)
+            return self.sendall(wfile, data)
+        server.CP_fileobject.sendall = sendall
+
+    def tearDown(self):
+        server.CP_fileobject.sendall = self.sendall
+        super(TestResponseWrites, self).tearDown()
+
+    def _application(self, chunks, length=True):
+        def serve(environ, start_response):
+            headers = []
+            if length:
+                headers.append(('Content-Length', str(sum(len(c) for c in chunks))))
+            start_response('200 OK', headers)
+            return chunks
+        return serve
+
+    def test_small_response(self):
+        self._serve(self._application(['{"status": "ok"}']))
+        self.assertEqual(self._request(), (200, '{"status": "ok"}'))
+        self.assertEqual(len(self.writes), 1)
+        self.assertTrue(self.writes[0].endswith('\r\n\r\n{"status": "ok"}'))
+
+    def test_large_response(self):
+        content = 'x' * (server.HTTPServer.coalesce_size + 1)
+        self._serve(self._application([content]))
+        self.assertEqual(self._request(), (200, content))
+        self.assertEqual(len(self.writes), 2)
+        self.assertTrue(self.writes[0].endswith('\r\n\r\n'))
+
+    def test_empty_chunked_response(self):
+        self._serve(self._application([], False))
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            for i in range(2):
+                connection.request('GET', '/')
+                self.assertEqual(connection.getresponse().read(), '')
+        finally:
+            connection.close()
+
+        self.assertEqual(len(self.writes), 2)
+        self.assertTrue(self.writes[0].endswith('\r\n\r\n0\r\n\r\n'))
+
+    def test_corked_responses(self):
+        content = 'x' * 100000
+        self._serve(self._application(['ok', content], False), cork=True)
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            for i in range(2):
+                connection.request('GET', '/')
+                self.assertEqual(connection.getresponse().read(), 'ok' + content)
+        finally:
+            connection.close()
+
+class TestUnixSocket(ServerTestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, 'server.sock')
+
+    def tearDown(self):
+        if hasattr(self, 'server'):
+            super(TestUnixSocket, self).tearDown()
+        rmtree(self.directory)
+
+    def _exchange(self, data):
+        connection = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            connection.connect(self.path)
+            connection.sendall(data)
+            received = ''
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    return received
+                received += chunk
+        finally:
+            connection.close()
+
+    def test_request(self):
+        self._serve(echo_application, 'unix:' + self.path, socket_mode=0600)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+
+        received = self._exchange('GET /path HTTP/1.1\r\nHost: localhost\r\n'
+            'Connection: close\r\n\r\n')
+        self.assertTrue(received.startswith('HTTP/1.1 200 OK'))
+        self.assertTrue(received.endswith('/path None'))
+
+    def test_stale_socket(self):
+        stale = socket(AF_UNIX, SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+
+        self._serve(echo_application, 'unix:' + self.path)
+        received = self._exchange('GET /path HTTP/1.1\r\nHost: localhost\r\n'
+            'Connection: close\r\n\r\n')
+        self.assertTrue(received.startswith('HTTP/1.1 200 OK'))
+
+    def test_address_in_use(self):
+        open(self.path, 'w').close()
+        self.assertRaises(socket_error, WsgiServer('unix:' + self.path, echo_application).prepare)
+        self.assertTrue(os.path.isfile(self.path))
+
+        os.unlink(self.path)
+        listening = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            listening.bind(self.path)
+            listening.listen(1)
+            self.assertRaises(socket_error,
+                WsgiServer('unix:' + self.path, echo_application).prepare)
+        finally:
+            listening.close()
+
+class TestSocketHandoff(ServerTestCase):
+    def test_inherit(self):
+        listening = socket(AF_INET, SOCK_STREAM)
+        try:
+            listening.bind(('127.0.0.1', 0))
+            listening.listen(5)
+            port = listening.getsockname()[1]
+
+            self.server = WsgiServer(('127.0.0.1', 0), echo_application)
+            self.server.inherit(os.dup(listening.fileno()), AF_INET)
+        finally:
+            listening.close()
+
+        self.thread = Thread(target=self.server.serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+        self.port = port
+        self.assertEqual(self._request('/inherited'), (200, '/inherited None'))
+
+    def test_drain(self):
+        self._serve(slow_application)
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            connection.request('GET', '/')
+            sleep(0.1)
+            self.server.drain()
+
+            response = connection.getresponse()
+            self.assertEqual((response.status, response.read()), (200, 'ok'))
+            self.assertEqual(response.getheader('Connection'), 'close')
+        finally:
+            connection.close()
+
+        self.thread.join(5)
+        self.assertFalse(self.thread.isAlive())
+        self.assertIsNone(self.server.socket)
+
+def pid_application(environ, start_response):
+    content = str(os.getpid())
+    start_response('200 OK', [('Content-Length', str(len(content)))])
+    return [content]
+
+class TestPreforkSupervisor(TestCase):
+    def _request(self):
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            connection.request('GET', '/')
+            return int(connection.getresponse().read())
+        finally:
+            connection.close()
+
+    def _alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def test_workers(self):
+        server = WsgiServer(('127.0.0.1', 0), pid_application, numthreads=2)
+        server.prepare()
+        self.port = server.socket.getsockname()[1]
+
+        supervisor = os.fork()
+        if not supervisor:
+            status = 1
+            try:
+                PreforkSupervisor(server, 2).run()
+                status = 0
+            finally:
+                os._exit(status)
+
+        server.socket.close()
+        try:
+            worker = self._request()
+            self.assertNotIn(worker, (os.getpid(), supervisor))
+
+            os.kill(worker, SIGKILL)
+            workers = set(self._request() for i in range(10))
+            self.assertNotIn(worker, workers)
+            self.assertNotIn(supervisor, workers)
+        finally:
+            os.kill(supervisor, SIGTERM)
+            self.assertEqual(os.waitpid(supervisor, 0)[1], 0)
+
+        for pid in workers:
+            self.assertFalse(self._alive(pid))
+
+class TestQueueWait(ServerTestCase):
+    def setUp(self):
+        self.waits = []
+
+    def _application(self, environ, start_response):
+        self.waits.append(environ.get('spire.queue_wait'))
+        start_response('200 OK', [('Content-Length', '2')])
+        return ['ok']
+
+    def test_keepalive_requests(self):
+        self._serve(self._application)
+        connection = HTTPConnection('127.0.0.1', self.port)
+        try:
+            for i in range(3):
+                connection.request('GET', '/')
+                self.assertEqual(connection.getresponse().read(), 'ok')
+        finally:
+            connection.close()
+
+        self.assertEqual(len(self.waits), 3)
+        for wait in self.waits:
+            self.assertIsInstance(wait, float)
+
+    def test_pipelined_requests(self):
+        self._serve(self._application)
+        received = self._exchange('GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+            'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        self.assertEqual(received.count('200 OK'), 2)
+        self.assertEqual(len(self.waits), 2)
+        self.assertIsInstance(self.waits[0], float)
+        self.assertIsNone(self.waits[1])
@@ -0,0 +1,319 @@
+import fcntl
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep, time
+
+from unittest2 import TestCase
+from werkzeug.contrib.sessions import FilesystemSessionStore
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from spire.core import Registry
+
+from spire.wsgi.server import PreforkSupervisor
+from spire.wsgi.sessions import *
+
+class SessionTestCase(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.store = FilesystemSessionStore(self.path, session_class=Session)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def _save(self, user_id=None, **data):
+        session = self.store.new()
+        session.update(data)
+        if user_id:
+            session['request.context'] = {'user-id': user_id}
+        self.store.save(session)
+        return session
+
+class TestLazySession(SessionTestCase):
+    def setUp(self):
+        super(TestLazySession, self).setUp()
+        Registry.purge()
+        self.loads = []
+
+    def _load(self, id):
+        self.loads.append(id)
+        return self.store.get(id)
+
+    def _middleware(self):
+        middleware = SessionMiddleware(store={'implementation': FilesystemSessionStore,
+            'path': self.path})
+        middleware.store.get = self._load
+        return middleware
+
+    def test_unloaded(self):
+        sid = self._save(value=1).sid
+        session = LazySession(self._load, sid, True)
+        self.assertEqual(session.sid, sid)
+        self.assertFalse(session.new)
+        self.assertFalse(session.loaded)
+        self.assertEqual(self.loads, [])
+
+        self.assertEqual(session['value'], 1)
+        self.assertEqual(session.get('value'), 1)
+        self.assertTrue(session.loaded)
+        self.assertEqual(self.loads, [sid])
+
+    def test_invalid_id(self):
+        session = LazySession(lambda id: self.store.new(), None, False)
+        self.assertTrue(session.new)
+        self.assertFalse(session.loaded)
+        self.assertNotEqual(session.sid, None)
+        self.assertTrue(session.loaded)
+
+    def test_untouched_sessions_are_not_loaded(self):
+        sid = self._save(value=1).sid
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return [environ['request.session'].sid]
+
+        client = Client(self._middleware().wrap(application), BaseResponse)
+        client.set_cookie('localhost', 'sessionid', sid)
+        response = client.get('/')
+        self.assertEqual(response.data, sid)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.loads, [])
+
+        client.delete_cookie('localhost', 'sessionid')
+        response = client.get('/')
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(len(self.store.list()), 1)
+
+    def test_touched_sessions_are_loaded(self):
+        sid = self._save(value=1).sid
+        def application(environ, start_response):
+            session = environ['request.session']
+            session['value'] += 1
+            start_response('200 OK', [])
+            return [str(session['value'])]
+
+        client = Client(self._middleware().wrap(application), BaseResponse)
+        client.set_cookie('localhost', 'sessionid', sid)
+        self.assertEqual(client.get('/').data, '2')
+        self.assertEqual(self.loads, [sid])
+        self.assertEqual(self.store.get(sid)['value'], 2)
+
+class TestSessionIndex(SessionTestCase):
+    def setUp(self):
+        super(TestSessionIndex, self).setUp()
+        self.index = SessionIndex(os.path.join(self.path, 'session-index'))
+
+    def test_add_find_discard(self):
+        self.index.add('alice', 'a' * 40)
+        self.index.add('alice', 'b' * 40)
+        self.index.add('bob', 'c' * 40)
+
+        self.assertEqual(sorted(self.index.find('alice')), ['a' * 40, 'b' * 40])
+        self.assertEqual(self.index.find('bob'), ['c' * 40])
+        self.assertEqual(self.index.find('carol'), [])
+
+        self.index.discard('alice', 'a' * 40)
+        self.index.discard('alice', 'a' * 40)
+        self.assertEqual(self.index.find('alice'), ['b' * 40])
+
+    def test_invalid_sid(self):
+        self.assertRaises(ValueError, self.index.add, 'alice', '../escape')
+
+    def test_update_only_indexes_new_users(self):
+        session = self.store.new()
+        self.index.update(session)
+        self.assertEqual(os.listdir(self.path), [])
+
+        session['request.context'] = {'user-id': 'alice'}
+        self.index.update(session)
+        self.assertEqual(self.index.find('alice'), [session.sid])
+        self.assertEqual(session.indexed_user_id, 'alice')
+
+    def test_rebuild(self):
+        alice = self._save('alice')
+        bob = self._save('bob')
+        self._save()
+
+        self.index.add('mallory', bob.sid)
+        self.index.add('alice', 'f' * 40)
+
+        self.assertEqual(self.index.rebuild(self.store), 2)
+        self.assertEqual(self.index.find('alice'), [alice.sid])
+        self.assertEqual(self.index.find('bob'), [bob.sid])
+        self.assertEqual(self.index.find('mallory'), [])
+
+class TestSessionWriter(SessionTestCase):
+    def setUp(self):
+        super(TestSessionWriter, self).setUp()
+        self.deleted = []
+        self.saved = []
+        self.writer = SessionWriter(self._store, self.deleted.append, 0.05)
+
+    def _store(self, session):
+        self.saved.append(session)
+        self.store.save(session)
+
+    def test_saves_are_coalesced(self):
+        session = self.store.new()
+        for i in range(5):
+            session['count'] = i
+            self.writer.save(session)
+
+        self.assertEqual(self.writer.get(session.sid)['count'], 4)
+        self.assertEqual(self.saved, [])
+
+        self.writer.flush()
+        self.assertEqual(len(self.saved), 1)
+        self.assertEqual(self.store.get(session.sid)['count'], 4)
+        self.assertIsNone(self.writer.get(session.sid))
+
+    def test_thread_flushes(self):
+        session = self.store.new()
+        session['value'] = 1
+        self.writer.save(session)
+
+        sleep(0.3)
+        self.assertEqual(self.store.get(session.sid)['value'], 1)
+
+    def test_delete_carries_user_id(self):
+        session = self.store.get(self._save('alice').sid)
+        self.assertEqual(session.indexed_user_id, 'alice')
+
+        self.writer.save(session)
+        self.writer.delete(session)
+        self.assertEqual(self.writer.get(session.sid), {})
+
+        self.writer.flush()
+        self.assertEqual(self.saved, [])
+        self.assertEqual([(s.sid, s.indexed_user_id) for s in self.deleted],
+            [(session.sid, 'alice')])
+
+    def test_flushes_in_forked_process(self):
+        self.writer.save(self.store.new())
+
+        session = self.store.new()
+        pid = os.fork()
+        if not pid:
+            try:
+                session['child'] = True
+                self.writer.save(session)
+                sleep(0.3)
+            finally:
+                os._exit(0)
+
+        os.waitpid(pid, 0)
+        self.assertEqual(self.store.get(session.sid).get('child'), True)
+
+    def test_flushes_when_worker_exits(self):
+        writer = SessionWriter(self._store, self.deleted.append, 60)
+        session = self.store.new()
+
+        class Server(object):
+            def serve(self):
+                session['worker'] = True
+                writer.save(session)
+
+            def error_log(self, *args, **params):
+                pass
+
+        pid = PreforkSupervisor(Server(), 1).spawn()
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(self.store.get(session.sid).get('worker'), True)
+
+class TestSessionSweeper(SessionTestCase):
+    def setUp(self):
+        super(TestSessionSweeper, self).setUp()
+        Registry.purge()
+        self.lock_path = os.path.join(self.path, 'sweep.lock')
+        self.sweeper = SessionSweeper(max_age=60, enabled=False, lock_path=self.lock_path)
+        self.sweeper.backend = SessionBackend(store={'implementation': FilesystemSessionStore,
+            'path': self.path})
+
+    def _expire(self, session):
+        filename = self.store.get_session_filename(session.sid)
+        os.utime(filename, (time() - 120, time() - 120))
+
+    def test_sweep(self):
+        fresh, stale = self._save(), self._save()
+        self._expire(stale)
+
+        self.assertEqual(self.sweeper.sweep(), 1)
+        self.assertEqual(self.store.list(), [fresh.sid])
+        self.assertEqual(self.sweeper.statistics['removed'], 1)
+
+    def test_sweep_lock(self):
+        self._expire(self._save())
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertIsNone(self.sweeper.sweep())
+            self.assertEqual(len(self.store.list()), 1)
+
+        self.assertEqual(self.sweeper.sweep(), 1)
+        self.assertEqual(self.store.list(), [])
+
+class TestSQLiteSessionStore(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.store = self._construct()
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def _construct(self, **params):
+        return SQLiteSessionStore(os.path.join(self.path, 'sessions.db'),
+            session_class=Session, **params)
+
+    def test_roundtrip(self):
+        session = self.store.new()
+        session['value'] = [1, 2]
+        self.store.save(session)
+
+        loaded = self.store.get(session.sid)
+        self.assertEqual(loaded, {'value': [1, 2]})
+        self.assertFalse(loaded.new)
+        self.assertEqual(self.store.list(), [session.sid])
+
+        self.store.delete(session)
+        self.assertEqual(self.store.get(session.sid), {})
+        self.assertEqual(self.store.list(), [])
+
+    def test_cached_sessions_are_validated_by_version(self):
+        other = self._construct()
+        session = self.store.new()
+        session['value'] = 1
+        self.store.save(session)
+        self.assertEqual(other.get(session.sid)['value'], 1)
+
+        session['value'] = 2
+        self.store.save(session)
+        self.assertEqual(other.get(session.sid)['value'], 2)
+
+        self.store.delete(session)
+        self.assertEqual(other.get(session.sid), {})
+
+    def test_cached_sessions_are_not_shared(self):
+        session = self.store.new()
+        session['context'] = {'user-id': 'alice'}
+        self.store.save(session)
+
+        first = self.store.get(session.sid)
+        first['context']['user-id'] = 'mallory'
+        self.assertEqual(self.store.get(session.sid)['context'], {'user-id': 'alice'})
+
+    def test_index(self):
+        alice = self.store.new()
+        alice['request.context'] = {'user-id': 'alice'}
+        self.store.save(alice)
+        self.store.save(self.store.new())
+
+        self.assertEqual(self.store.index.find('alice'), [alice.sid])
+        self.assertEqual(self.store.index.rebuild(self.store), 1)
+
+    def test_expire(self):
+        fresh, stale = self.store.new(), self.store.new()
+        self.store.save(fresh)
+        self.store.save(stale)
+        self.store.execute('update sessions set modified = 0 where sid = ?', (stale.sid,), True)
+
+        self.assertEqual(self.store.expire(1, 10), 1)
+        self.assertEqual(self.store.list(), [fresh.sid])
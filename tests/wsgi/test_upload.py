@@ -0,0 +1,152 @@
+import fcntl
+import hashlib
+import os
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from unittest2 import TestCase
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request, Response
+
+from spire.core import *
+from spire.wsgi.upload import UploadEndpoint, UploadManager, UploadStore
+
+class UploadTestCase(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.store = UploadStore(self.path)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def _upload(self, id, content):
+        path = self.store.stage(id)
+        with open(path, 'w') as openfile:
+            openfile.write(content)
+        digest = hashlib.sha1(content).hexdigest()
+        self.store.commit(id, path, digest)
+        return digest
+
+    def _content(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest[2:4], digest, 'content')
+
+class TestUploadStore(UploadTestCase):
+    def test_commit(self):
+        digest = self._upload('a_file.txt', 'content')
+        self.assertEqual(os.listdir(os.path.join(self.path, 'staging')), [])
+
+        path = self.store.find('a_file.txt')
+        self.assertEqual(path, os.path.join(self.path, 'refs', 'a_', 'a_file.txt'))
+        self.assertEqual(open(path).read(), 'content')
+        self.assertEqual(os.stat(self._content(digest)).st_nlink, 2)
+        self.assertIsNone(self.store.find('missing'))
+
+    def test_dedupe(self):
+        digest = self._upload('first', 'content')
+        self.assertEqual(self._upload('second', 'content'), digest)
+        other = self._upload('third', 'other content')
+
+        self.assertEqual(os.stat(self._content(digest)).st_nlink, 3)
+        self.assertEqual(os.stat(self._content(other)).st_nlink, 2)
+        self.assertEqual(open(self.store.find('first')).read(), 'content')
+        self.assertEqual(open(self.store.find('second')).read(), 'content')
+
+    def test_dispose(self):
+        digest = self._upload('first', 'content')
+        self._upload('second', 'content')
+
+        self.assertTrue(self.store.dispose('first'))
+        self.assertIsNone(self.store.find('first'))
+        self.assertFalse(self.store.dispose('first'))
+        self.assertEqual(open(self.store.find('second')).read(), 'content')
+        self.assertEqual(os.stat(self._content(digest)).st_nlink, 2)
+
+        self.assertTrue(self.store.dispose('second'))
+        self.assertFalse(os.path.exists(os.path.dirname(self._content(digest))))
+
+        self._upload('third', 'content')
+        self.assertEqual(open(self.store.find('third')).read(), 'content')
+
+    def test_invalid_ids(self):
+        for id in ('', '.hidden', 'a/b'):
+            self.assertRaises(ValueError, self.store.find, id)
+            self.assertRaises(ValueError, self.store.dispose, id)
+
+    def test_sweep(self):
+        self._upload('first', 'content')
+        self._upload('second', 'other content')
+        open(self.store.stage('partial'), 'w').close()
+
+        self.assertEqual(self.store.sweep(3600), 0)
+        self.assertIsNotNone(self.store.find('first'))
+        self.assertEqual(os.listdir(os.path.join(self.path, 'staging')), ['partial'])
+
+        self.assertEqual(self.store.sweep(-10), 2)
+        self.assertIsNone(self.store.find('first'))
+        self.assertIsNone(self.store.find('second'))
+        self.assertEqual(os.listdir(os.path.join(self.path, 'staging')), [])
+
+class TestUploadEndpoint(UploadTestCase):
+    def setUp(self):
+        super(TestUploadEndpoint, self).setUp()
+        Registry.purge()
+
+    def _post(self, data, **params):
+        endpoint = UploadEndpoint(path='/upload', upload_directory=self.path, **params)
+        environ = EnvironBuilder(method='POST', data=data).get_environ()
+        response = Response()
+        endpoint._dispatch_request(Request(environ), response)
+        return response
+
+    def test_upload(self):
+        response = self._post({'field': 'value', 'file': (StringIO('content'), 'a.txt')},
+            max_request_size=1000)
+        self.assertIn('_a.txt', response.data)
+
+    def test_form_memory_limits(self):
+        self.assertRaises(RequestEntityTooLarge, self._post, {'field': 'x' * 2000},
+            max_form_memory_size=1000)
+        self.assertRaises(RequestEntityTooLarge, self._post, {'field': 'x' * 2000},
+            max_request_size=1000)
+        self._post({'field': 'x' * 500}, max_form_memory_size=1000)
+
+class TestUploadManager(UploadTestCase):
+    def setUp(self):
+        super(TestUploadManager, self).setUp()
+        Registry.purge()
+
+    def _construct(self, **params):
+        return UploadManager(upload_directory=self.path, **params)
+
+    def test_sweep_lock(self):
+        path = os.path.join(self.path, 'sweep.lock')
+        manager = self._construct(ttl=3600, lock_path=path)
+        self._upload('first', 'content')
+
+        with open(path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertIsNone(manager.sweep())
+        self.assertEqual(manager.sweep(), 0)
+
+    def test_sweeper_started_in_forked_process(self):
+        manager = self._construct(ttl=3600)
+        self.assertTrue(manager.sweeper.isAlive())
+
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                manager.dispose('missing')
+                if manager.pid == os.getpid() and manager.sweeper.isAlive():
+                    status = 0
+            finally:
+                os._exit(status)
+
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_no_sweeper_without_ttl(self):
+        manager = self._construct()
+        manager.dispose('missing')
+        self.assertIsNone(manager.sweeper)
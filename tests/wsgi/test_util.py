@@ -0,0 +1,144 @@
+from unittest2 import TestCase
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from spire.wsgi.util import MountDispatcher, get_environ_index, set_environ_item
+
+class TestEnvironIndex(TestCase):
+    def _environ(self, **params):
+        environ = {'PATH_INFO': '/', 'HTTP_X_SPIRE_USER': 'alice',
+            'HTTP_X_OTHER': 'value', 'request.id': 1}
+        environ.update(params)
+        return environ
+
+    def test_index(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        self.assertIs(get_environ_index(environ), index)
+        self.assertEqual(index.get_attributes(environ), {'id': 1})
+        self.assertEqual(index.get_headers(environ, 'HTTP_X_SPIRE_'), {'user': 'alice'})
+        self.assertEqual(index.get_headers(environ, 'PATH_'), {'info': '/'})
+
+    def test_set_environ_item(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        index.get_headers(environ, 'HTTP_X_SPIRE_')
+
+        set_environ_item(environ, 'request.session', 'session')
+        set_environ_item(environ, 'HTTP_X_SPIRE_CONTEXT', 'context')
+        self.assertEqual(environ['request.session'], 'session')
+        self.assertEqual(index.get_attributes(environ), {'id': 1, 'session': 'session'})
+        self.assertEqual(index.get_headers(environ, 'HTTP_X_SPIRE_'),
+            {'user': 'alice', 'context': 'context'})
+
+    def test_direct_additions(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        index.get_headers(environ, 'HTTP_X_SPIRE_')
+
+        environ['request.session'] = 'session'
+        environ['HTTP_X_SPIRE_CONTEXT'] = 'context'
+        self.assertEqual(index.get_attributes(environ), {'id': 1, 'session': 'session'})
+        self.assertEqual(index.get_headers(environ, 'HTTP_X_SPIRE_'),
+            {'user': 'alice', 'context': 'context'})
+
+    def test_overwritten_entries(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        index.get_attributes(environ)
+        index.get_headers(environ, 'HTTP_X_SPIRE_')
+
+        environ['request.id'] = 2
+        environ['HTTP_X_SPIRE_USER'] = 'bob'
+        self.assertEqual(index.get_attributes(environ), {'id': 2})
+        self.assertEqual(index.get_headers(environ, 'HTTP_X_SPIRE_'), {'user': 'bob'})
+
+    def test_replaced_entries(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        index.get_attributes(environ)
+        index.get_headers(environ, 'HTTP_X_SPIRE_')
+
+        del environ['request.id']
+        del environ['HTTP_X_SPIRE_USER']
+        environ['request.session'] = 'session'
+        environ['HTTP_X_SPIRE_CONTEXT'] = 'context'
+        self.assertEqual(index.get_attributes(environ), {'session': 'session'})
+        self.assertEqual(index.get_headers(environ, 'HTTP_X_SPIRE_'), {'context': 'context'})
+
+    def test_copied_environ(self):
+        environ = self._environ()
+        index = get_environ_index(environ)
+        index.get_attributes(environ)
+
+        copy = dict(environ)
+        del copy['request.id']
+        copy['request.session'] = 'session'
+        self.assertIs(get_environ_index(copy), index)
+        self.assertEqual(index.get_attributes(copy), {'session': 'session'})
+        self.assertEqual(index.get_attributes(environ), {'id': 1})
+
+class StubMount(object):
+    def __init__(self, path, shared_path=''):
+        self.path = path
+        self.shared_path = shared_path
+        self.unshared_path = path[:-len(shared_path)] if shared_path else path
+
+    def __call__(self, environ, start_response):
+        content = '%s %s' % (environ['SCRIPT_NAME'], environ['PATH_INFO'])
+        return BaseResponse(content)(environ, start_response)
+
+class TestMountDispatcher(TestCase):
+    def _dispatcher(self, *paths):
+        return MountDispatcher([StubMount(path) for path in paths])
+
+    def _match(self, dispatcher, path):
+        mount, length, statistics = dispatcher._match(path)
+        if mount is not None:
+            self.assertIs(statistics, dispatcher.statistics[mount.path])
+            return mount.path, length
+
+    def test_longest_prefix(self):
+        dispatcher = self._dispatcher('/api', '/api/v2', '/static')
+        self.assertEqual(self._match(dispatcher, '/api'), ('/api', 4))
+        self.assertEqual(self._match(dispatcher, '/api/v1/users'), ('/api', 4))
+        self.assertEqual(self._match(dispatcher, '/api/v2'), ('/api/v2', 7))
+        self.assertEqual(self._match(dispatcher, '/api/v2/users'), ('/api/v2', 7))
+        self.assertEqual(self._match(dispatcher, '/static/app.js'), ('/static', 7))
+
+    def test_segment_boundary(self):
+        dispatcher = self._dispatcher('/api', '/api/v2')
+        self.assertIsNone(self._match(dispatcher, '/apis'))
+        self.assertEqual(self._match(dispatcher, '/api/v20'), ('/api', 4))
+
+    def test_root_mount(self):
+        dispatcher = self._dispatcher('/', '/api')
+        self.assertEqual(self._match(dispatcher, '/'), ('/', 1))
+        self.assertEqual(self._match(dispatcher, '/other'), ('/', 0))
+        self.assertEqual(self._match(dispatcher, ''), ('/', 0))
+        self.assertEqual(self._match(dispatcher, '/api/users'), ('/api', 4))
+
+    def test_duplicate_paths(self):
+        first, second = StubMount('/api'), StubMount('/api')
+        dispatcher = MountDispatcher([first, second])
+        self.assertIs(dispatcher._match('/api')[0], first)
+
+    def test_dispatch(self):
+        dispatcher = self._dispatcher('/api')
+        dispatcher.mount(StubMount('/shared/service', '/service'))
+        client = Client(dispatcher, BaseResponse)
+
+        response = client.get('/api/users')
+        self.assertEqual(response.data, '/api /users')
+        response = client.get('/shared/service/status')
+        self.assertEqual(response.data, '/shared /service/status')
+        self.assertEqual(client.get('/other').status_code, 404)
+
+    def test_mount_clears_cache(self):
+        dispatcher = self._dispatcher('/api')
+        client = Client(dispatcher, BaseResponse)
+        self.assertEqual(client.get('/api/v2/users').data, '/api /v2/users')
+
+        dispatcher.mount(StubMount('/api/v2'))
+        self.assertEqual(client.get('/api/v2/users').data, '/api/v2 /users')